@@ -0,0 +1,297 @@
+import asyncio
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import time
+from collections import OrderedDict
+
+import aiohttp
+
+from persona_repository import write_atomic
+
+IMAGE_TYPES = {"image/png", "image/jpeg", "image/webp", "image/heic", "image/heif"}
+DOCUMENT_TYPES = {"application/pdf"}
+TEXT_TYPES = {"application/json", "application/xml", "application/x-yaml", "application/yaml", "application/javascript",
+              "application/x-sh", "application/sql"}
+TEXT_EXTENSIONS = {".txt", ".log", ".md", ".csv", ".json", ".yaml", ".yml", ".xml", ".ini", ".toml", ".cfg",
+                   ".py", ".js", ".ts", ".java", ".c", ".cpp", ".h", ".cs", ".go", ".rs", ".sh", ".sql", ".html", ".css"}
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+IMAGE_TOKENS = 258  # coût Gemini d'une image (par tuile de 768 px, une seule en général pour Discord)
+DOCUMENT_TOKENS_PER_KB = 5  # PDF : 258 tokens par page, ~50 Ko par page
+
+MARKER = re.compile(r"\[pièce jointe ([0-9a-f]{32}) ([^ \]]+) ([^\]]*)\]")
+
+
+class AttachmentRejected(Exception):
+    pass
+
+
+def classify(content_type: str, filename: str):
+    """Retourne (type MIME, mode) où mode vaut "text" (texte extrait) ou "blob" (envoyé tel quel à Gemini)."""
+    mime = (content_type or "").split(";")[0].strip().lower() or mimetypes.guess_type(filename)[0] or ""
+    extension = os.path.splitext(filename)[1].lower()
+    if mime in IMAGE_TYPES or mime in DOCUMENT_TYPES: return mime, "blob"
+    if mime.startswith("text/") or mime in TEXT_TYPES or extension in TEXT_EXTENSIONS: return mime or "text/plain", "text"
+    raise AttachmentRejected(f"type {mime or extension or 'inconnu'} non pris en charge")
+
+
+def expanded_tokens(mode: str, mime: str, size: int) -> int:
+    """Estimation des tokens qu'une pièce jointe coûte une fois développée par expand()."""
+    if mode == "text": return size // 4 + 10
+    if mime in IMAGE_TYPES: return IMAGE_TOKENS
+    return max(IMAGE_TOKENS, size // 1024 * DOCUMENT_TOKENS_PER_KB)
+
+
+def marker_for(key: str, mime: str, name: str) -> str:
+    """Référence textuelle d'une pièce jointe, stockée dans l'historique à la place de son contenu."""
+    name = re.sub(r"[\]\n\r]", "_", name)[:100]
+    return f"[pièce jointe {key} {mime} {name}]"
+
+
+class AttachmentStore:
+    """Pièces jointes Discord pour Gemini, dédupliquées par hash de contenu.
+
+    Les fichiers sont téléchargés en flux (plafonds de taille, de nombre et de type) directement dans un cache
+    disque nommé par leur sha256 ; l'historique ne garde qu'un marqueur `[pièce jointe <hash> <type> <nom>]`,
+    développé à chaque tour par expand() :
+    - texte (logs, code...) : texte extrait une fois, tronqué à `max_text_chars` ;
+    - petits fichiers (<= `inline_max_bytes`) : octets envoyés inline ;
+    - les autres : envoyés une fois par l'API Files de Gemini, la référence (48 h côté Google) est réutilisée.
+
+    Le cache est borné par `disk_budget_bytes` (LRU) et `ttl_hours` depuis la dernière utilisation.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 8 * 1024 * 1024, max_count: int = 4, max_text_chars: int = 20000,
+                 inline_max_bytes: int = 256 * 1024, disk_budget_bytes: int = 200 * 1024 * 1024, ttl_hours: float = 24,
+                 upload_ttl_hours: float = 47):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_count = max_count
+        self.max_text_chars = max_text_chars
+        self.inline_max_bytes = inline_max_bytes
+        self.disk_budget = disk_budget_bytes
+        self.ttl = ttl_hours * 3600
+        self.upload_ttl = upload_ttl_hours * 3600
+        self._entries = OrderedDict()
+        self._by_attachment_id = OrderedDict()
+        self._downloads = {}
+        self._uploads = {}
+        self._session = None
+        self.downloads = 0
+        self.dedup_hits = 0
+        self.uploads = 0
+        self.rejected = 0
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.directory, "index.json")
+
+    def load(self):
+        """Relit l'index du cache au démarrage et oublie les entrées dont le fichier a disparu."""
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            if name.startswith(".tmp-"): os.unlink(os.path.join(self.directory, name))
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f: entries = json.load(f)
+        except FileNotFoundError: entries = {}
+        except Exception as e: logging.error(f"Index du cache des pièces jointes illisible, cache vidé: {e}"); entries = {}
+        for key, entry in sorted(entries.items(), key=lambda item: item[1].get("last_used", 0)):
+            if not os.path.exists(self._path(key)): continue
+            entry.setdefault("tokens", expanded_tokens(entry["mode"], entry["mime"], entry["size"]))
+            self._entries[key] = entry
+        logging.info(f"Cache des pièces jointes: {len(self._entries)} fichier(s), {self._stored_bytes() // 1024} Ko.")
+
+    async def close(self):
+        if self._session is not None: await self._session.close(); self._session = None
+        await self._save_index()
+
+    async def ingest(self, attachments) -> list:
+        """Télécharge (ou retrouve dans le cache) les pièces jointes d'un message. Retourne les marqueurs à
+        ajouter au message, avec une note pour chaque fichier ignoré."""
+        markers = []
+        for index, attachment in enumerate(attachments):
+            try:
+                if index >= self.max_count: raise AttachmentRejected(f"plus de {self.max_count} pièces jointes")
+                markers.append(await self._ingest_one(attachment))
+            except AttachmentRejected as e:
+                self.rejected += 1
+                logging.info(f"Pièce jointe '{attachment.filename}' ignorée: {e}")
+                markers.append(f"[pièce jointe {attachment.filename} ignorée : {e}]")
+            except Exception as e:
+                logging.error(f"Téléchargement de '{attachment.filename}' échoué: {e}")
+                markers.append(f"[pièce jointe {attachment.filename} illisible]")
+        await self._enforce_budget()
+        return markers
+
+    async def expand(self, contents):
+        """Remplace les marqueurs des `contents` par les parts Gemini correspondantes (sans toucher à l'historique)."""
+        expanded = []
+        for turn in contents:
+            if not any(isinstance(p, str) and "[pièce jointe " in p for p in turn.get("parts", [])):
+                expanded.append(turn); continue
+            parts = []
+            for part in turn["parts"]:
+                if isinstance(part, str): parts.extend(await self._expand_text(part))
+                else: parts.append(part)
+            expanded.append({**turn, "parts": parts})
+        return expanded
+
+    def estimate_tokens(self, text: str) -> int:
+        """Tokens ajoutés par le développement des marqueurs de `text` (le marqueur lui-même non compris)."""
+        if "[pièce jointe " not in text: return 0
+        total = 0
+        for match in MARKER.finditer(text):
+            entry = self._entries.get(match.group(1))
+            if entry is not None: total += entry["tokens"]
+        return total
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "bytes": self._stored_bytes(), "downloads": self.downloads,
+                "dedup_hits": self.dedup_hits, "uploads": self.uploads, "rejected": self.rejected}
+
+    async def _ingest_one(self, attachment) -> str:
+        mime, mode = classify(attachment.content_type, attachment.filename)
+        if attachment.size > self.max_bytes:
+            raise AttachmentRejected(f"{attachment.size // 1024} Ko, maximum {self.max_bytes // 1024} Ko")
+        key = self._by_attachment_id.get(attachment.id)
+        if key is None or key not in self._entries:
+            pending = self._downloads.get(attachment.id)
+            if pending is None:
+                pending = self._downloads[attachment.id] = asyncio.ensure_future(self._download(attachment, mime, mode))
+                pending.add_done_callback(lambda _: self._downloads.pop(attachment.id, None))
+            key = await pending
+        else: self.dedup_hits += 1
+        self._touch(key)
+        return marker_for(key, self._entries[key]["mime"], attachment.filename)
+
+    async def _download(self, attachment, mime: str, mode: str) -> str:
+        """Flux HTTP -> fichier temporaire, en calculant le hash au passage : le fichier n'est jamais entier en mémoire."""
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = os.path.join(self.directory, f".tmp-{attachment.id}")
+        digest = hashlib.sha256(); size = 0
+        try:
+            async with self._http().get(attachment.url) as response:
+                response.raise_for_status()
+                with open(tmp_path, "wb") as f:
+                    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_BYTES):
+                        size += len(chunk)
+                        if size > self.max_bytes: raise AttachmentRejected(f"plus de {self.max_bytes // 1024} Ko")
+                        digest.update(chunk); f.write(chunk)
+            self.downloads += 1
+            key = digest.hexdigest()[:32]
+            self._remember_attachment(attachment.id, key)
+            if key in self._entries:
+                self.dedup_hits += 1; return key
+            stored = await asyncio.to_thread(self._store, tmp_path, key, mode)
+            mime = "text/plain" if mode == "text" else mime
+            self._entries[key] = {"mime": mime, "name": attachment.filename, "mode": mode, "size": stored,
+                                  "tokens": expanded_tokens(mode, mime, stored), "last_used": time.time()}
+            logging.info(f"Pièce jointe '{attachment.filename}' mise en cache ({key}, {stored // 1024} Ko).")
+            await self._save_index()
+            return key
+        finally:
+            if os.path.exists(tmp_path): os.unlink(tmp_path)
+
+    def _store(self, tmp_path: str, key: str, mode: str) -> int:
+        if mode == "text":
+            with open(tmp_path, "rb") as f: raw = f.read(self.max_text_chars * 4)
+            text = raw.decode("utf-8", errors="replace")[:self.max_text_chars]
+            write_atomic(self._path(key), text)
+        else: os.replace(tmp_path, self._path(key))
+        return os.path.getsize(self._path(key))
+
+    async def _expand_text(self, text: str) -> list:
+        parts, position = [], 0
+        for match in MARKER.finditer(text):
+            before = text[position:match.start()].strip()
+            if before: parts.append(before)
+            parts.append(await self._part_for(*match.groups()))
+            position = match.end()
+        rest = text[position:].strip()
+        if rest or not parts: parts.append(rest)
+        return parts
+
+    async def _part_for(self, key: str, mime: str, name: str):
+        entry = self._entries.get(key)
+        if entry is None: return f"[pièce jointe {name} expirée]"
+        self._touch(key)
+        try:
+            if entry["mode"] == "text":
+                text = await asyncio.to_thread(self._read, key, "r")
+                return f"Fichier {name} :\n```\n{text}\n```"
+            if entry["size"] <= self.inline_max_bytes:
+                return {"inline_data": {"mime_type": entry["mime"], "data": await asyncio.to_thread(self._read, key, "rb")}}
+            return {"file_data": {"mime_type": entry["mime"], "file_uri": await self._file_uri(key, entry)}}
+        except Exception as e:
+            logging.warning(f"Pièce jointe {key} indisponible pour Gemini: {e}")
+            return f"[pièce jointe {name} indisponible]"
+
+    async def _file_uri(self, key: str, entry: dict) -> str:
+        if entry.get("upload_uri") and entry.get("upload_expires_at", 0) > time.time(): return entry["upload_uri"]
+        pending = self._uploads.get(key)
+        if pending is None:
+            pending = self._uploads[key] = asyncio.ensure_future(self._upload(key, entry))
+            pending.add_done_callback(lambda _: self._uploads.pop(key, None))
+        return await pending
+
+    async def _upload(self, key: str, entry: dict) -> str:
+        import google.generativeai as genai
+        uploaded = await asyncio.to_thread(genai.upload_file, self._path(key), mime_type=entry["mime"],
+                                           display_name=entry["name"][:100])
+        self.uploads += 1
+        entry["upload_uri"] = uploaded.uri
+        entry["upload_expires_at"] = time.time() + self.upload_ttl
+        logging.info(f"Pièce jointe {key} envoyée à l'API Files ({uploaded.name}).")
+        await self._save_index()
+        return uploaded.uri
+
+    async def _enforce_budget(self):
+        cutoff = time.time() - self.ttl
+        removed = [key for key, entry in self._entries.items() if entry["last_used"] < cutoff]
+        total = self._stored_bytes() - sum(self._entries[key]["size"] for key in removed)
+        for key in self._entries:
+            if total <= self.disk_budget: break
+            if key in removed: continue
+            removed.append(key); total -= self._entries[key]["size"]
+        if not removed: return
+        for key in removed: self._entries.pop(key)
+        await asyncio.to_thread(self._delete_files, removed)
+        logging.info(f"Cache des pièces jointes: {len(removed)} fichier(s) évincé(s).")
+        await self._save_index()
+
+    def _touch(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None: return
+        entry["last_used"] = time.time(); self._entries.move_to_end(key)
+
+    def _remember_attachment(self, attachment_id, key: str):
+        self._by_attachment_id[attachment_id] = key
+        while len(self._by_attachment_id) > 1000: self._by_attachment_id.popitem(last=False)
+
+    def _http(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60))
+        return self._session
+
+    def _stored_bytes(self) -> int:
+        return sum(entry["size"] for entry in self._entries.values())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _read(self, key: str, mode: str):
+        with open(self._path(key), mode, **({"encoding": "utf-8"} if mode == "r" else {})) as f: return f.read()
+
+    def _delete_files(self, keys):
+        for key in keys:
+            try: os.unlink(self._path(key))
+            except FileNotFoundError: pass
+
+    async def _save_index(self):
+        if not os.path.isdir(self.directory): return
+        data = json.dumps(self._entries, ensure_ascii=False)
+        try: await asyncio.to_thread(write_atomic, self.index_path, data)
+        except Exception as e: logging.error(f"Sauvegarde de l'index des pièces jointes échouée: {e}")
@@ -0,0 +1,462 @@
+"""Banc d'essai hors ligne du chemin chaud : faux Discord, faux Gemini, aucune requête réseau.
+
+Exemples :
+    python benchmark.py --concurrency 1,4,16 --messages 200
+    python benchmark.py --latency 0.8 --token-rate 40 --error-rate 0.05 --no-stream
+    python benchmark.py --replay traffic.jsonl --commands
+
+Format de rejeu (une ligne JSON par événement) :
+    {"t": 0.5, "channel": 1, "author": "alice", "content": "salut"}
+    {"t": 1.0, "channel": 1, "author": "bob", "command": "persona_set", "args": {"persona_id": "2"}}
+Les lignes sans "content" mais avec "body"/"title" (ex. requests.jsonl) sont rejouées comme messages.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+_TMP = tempfile.mkdtemp(prefix="fentdroid-bench-")
+os.environ.setdefault("CONVERSATIONS_DB", os.path.join(_TMP, "conversations.db"))
+
+from google.api_core import exceptions as google_exceptions
+
+import bot as bot_module
+import commands as commands_module
+
+_ids = itertools.count(1000)
+
+
+# --- Faux Gemini -------------------------------------------------------------------------
+
+class FakeBackend:
+    """Comportement du faux Gemini : latence jusqu'au premier token, débit, taux d'erreur, longueur de réponse."""
+
+    def __init__(self, latency: float = 0.3, token_rate: float = 80, error_rate: float = 0.0,
+                 response_tokens: int = 120, chunk_tokens: int = 8, seed: int = 0):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.error_rate = error_rate
+        self.response_tokens = response_tokens
+        self.chunk_tokens = chunk_tokens
+        self.random = random.Random(seed)
+        self.prompt_chars = []
+        self.calls = 0
+        self.errors = 0
+
+    def record_prompt(self, system_instruction, contents):
+        self.calls += 1
+        size = len(system_instruction or "")
+        if isinstance(contents, str): size += len(contents)
+        else: size += sum(len(p) for turn in contents for p in turn.get("parts", []) if isinstance(p, str))
+        self.prompt_chars.append(size)
+
+    def maybe_fail(self):
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors += 1
+            raise google_exceptions.ServiceUnavailable("faux Gemini: erreur injectée")
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+        self.parts = [text] if text else []
+
+
+class FakeStream:
+    def __init__(self, backend: FakeBackend, words):
+        self.backend = backend
+        self.words = words
+        self.position = 0
+        self.first = True
+
+    def __aiter__(self): return self
+
+    async def __anext__(self):
+        if self.position >= len(self.words): raise StopAsyncIteration
+        if self.first: await asyncio.sleep(self.backend.latency); self.first = False
+        chunk = self.words[self.position:self.position + self.backend.chunk_tokens]
+        self.position += len(chunk)
+        await asyncio.sleep(len(chunk) / self.backend.token_rate)
+        return FakeResponse(" ".join(chunk) + " ")
+
+
+class FakeCountTokens:
+    def __init__(self, total_tokens): self.total_tokens = total_tokens
+
+
+class FakeGeminiModel:
+    def __init__(self, backend: FakeBackend, system_instruction: str = None):
+        self.backend = backend
+        self.system_instruction = system_instruction
+
+    def _words(self):
+        return [f"mot{i}" for i in range(self.backend.response_tokens)]
+
+    async def generate_content_async(self, contents, stream=False):
+        self.backend.record_prompt(self.system_instruction, contents)
+        self.backend.maybe_fail()
+        if stream: return FakeStream(self.backend, self._words())
+        await asyncio.sleep(self.backend.latency + self.backend.response_tokens / self.backend.token_rate)
+        return FakeResponse(" ".join(self._words()))
+
+    async def count_tokens_async(self, text):
+        return FakeCountTokens(max(1, len(text) // 4))
+
+
+class FakeModelPool:
+    """Remplace ModelPool : même interface, modèles factices."""
+
+    def __init__(self, backend: FakeBackend):
+        self.backend = backend
+        self._models = {}
+
+    def __len__(self): return len(self._models)
+
+    def get(self, persona_id, prompt, model_name=None):
+        key = (persona_id, model_name, prompt)
+        model = self._models.get(key)
+        if model is None: model = self._models[key] = FakeGeminiModel(self.backend, prompt)
+        return model
+
+    def invalidate(self, persona_id):
+        for key in [k for k in self._models if k[0] == persona_id]: del self._models[key]
+
+
+# --- Faux Discord ------------------------------------------------------------------------
+
+class Recorder:
+    def __init__(self):
+        self.first_reply = {}
+        self.sent = 0
+        self.edits = 0
+        self.busy = 0
+
+
+class FakeUser:
+    def __init__(self, name: str, user_id: int = None, bot: bool = False):
+        self.id = user_id or next(_ids)
+        self.name = self.display_name = name
+        self.bot = bot
+
+    def __str__(self): return self.name
+
+    def mentioned_in(self, message) -> bool:
+        return f"<@{self.id}>" in message.content
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int): self.id = guild_id
+
+
+class _Typing:
+    async def __aenter__(self): return self
+    async def __aexit__(self, *exc): return False
+
+
+class FakeSentMessage:
+    def __init__(self, channel, content: str):
+        self.id = next(_ids); self.channel = channel; self.content = content
+
+    async def edit(self, content=None, **kwargs):
+        self.channel.recorder.edits += 1; self.content = content
+
+
+class FakeChannel:
+    """Salon factice. Si `coalesced`, une réponse compte aussi pour les messages précédents sans réponse (rafale)."""
+
+    def __init__(self, channel_id: int, guild: FakeGuild, recorder: Recorder, coalesced: bool = False):
+        self.id = channel_id; self.guild = guild; self.recorder = recorder
+        self.coalesced = coalesced
+        self.unanswered = []
+
+    def typing(self): return _Typing()
+
+    async def send(self, content=None, **kwargs):
+        self.recorder.sent += 1
+        return FakeSentMessage(self, content)
+
+
+class FakeMessage:
+    def __init__(self, channel: FakeChannel, author: FakeUser, content: str):
+        self.id = next(_ids); self.channel = channel; self.guild = channel.guild
+        self.author = author; self.content = content; self.attachments = []
+        self.created = time.perf_counter()
+        channel.unanswered.append(self)
+
+    async def reply(self, content=None, mention_author=True, **kwargs):
+        channel = self.channel; recorder = channel.recorder
+        recorder.sent += 1
+        if content and content.startswith("Trop de demandes"): recorder.busy += 1
+        now = time.perf_counter()
+        answered = [m for m in channel.unanswered if m is self or (channel.coalesced and m.created <= self.created)]
+        for m in answered:
+            recorder.first_reply.setdefault(m.id, now - m.created)
+            channel.unanswered.remove(m)
+        return FakeSentMessage(channel, content)
+
+
+class FakeResponseHandle:
+    def __init__(self, interaction): self.interaction = interaction; self.done = False
+
+    async def defer(self, **kwargs): self.done = True
+    async def send_message(self, *args, **kwargs): self.done = True; self.interaction.outputs.append(args or kwargs)
+    async def edit_message(self, *args, **kwargs): self.done = True; self.interaction.outputs.append(args or kwargs)
+
+
+class FakeFollowup:
+    def __init__(self, interaction): self.interaction = interaction
+    async def send(self, *args, **kwargs): self.interaction.outputs.append(args or kwargs)
+
+
+class FakeInteraction:
+    def __init__(self, user: FakeUser, channel: FakeChannel):
+        self.user = user; self.channel = channel; self.guild_id = channel.guild.id
+        self.response = FakeResponseHandle(self); self.followup = FakeFollowup(self)
+        self.outputs = []
+
+
+# --- Mesures -----------------------------------------------------------------------------
+
+class LoopLagSampler:
+    """Mesure le retard de la boucle asyncio : écart entre le réveil prévu et le réveil réel."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval; self.samples = []; self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - start - self.interval))
+
+    def start(self): self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try: await self._task
+        except asyncio.CancelledError: pass
+
+
+def percentile(values, p):
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+# --- Scénarios ---------------------------------------------------------------------------
+
+def prepare_bot(backend: FakeBackend, stream: bool, coalesce: bool, target_channel_id: int):
+    bot = bot_module.bot
+    bot_user = FakeUser("Fent-Droid", bot=True)
+    bot._connection.user = bot_user
+    bot.models = FakeModelPool(backend)
+    bot.history.summary_model = FakeGeminiModel(backend)
+    bot_module.model = FakeGeminiModel(backend)
+    bot_module.STREAM_RESPONSES = stream
+    bot_module.COALESCE_TARGET_CHANNEL = coalesce
+    bot_module.TARGET_CHANNEL_ID = target_channel_id
+    for name in ("personas.json", "prompt.txt"):
+        if os.path.exists(name): shutil.copy(name, _TMP)
+    bot.persona_repo.personas_file = os.path.join(_TMP, "personas.json")
+    bot.persona_repo.prompt_file = os.path.join(_TMP, "prompt.txt")
+    if not bot.tree.get_command("persona_set"): commands_module.setup(bot)
+    return bot, bot_user
+
+
+def reset_state(bot):
+    for conversation in bot.conversations.conversations(): bot.conversations.discard(conversation.key)
+
+
+async def drain(*long_lived):
+    """Attend la fin des tâches de fond lancées par le bot (rafales, résumés...), hors tâches permanentes."""
+    keep = {asyncio.current_task(), *long_lived}
+    while True:
+        pending = [t for t in asyncio.all_tasks() if t not in keep and not t.done()]
+        if not pending and not bot_module.bot.coalescer.pending: return
+        if pending: await asyncio.wait(pending, timeout=1)
+        else: await asyncio.sleep(0.05)
+
+
+async def run_closed_loop(bot, bot_user, concurrency: int, messages: int, use_target_channel: bool, target_channel_id: int, lag_task=None):
+    """`concurrency` utilisateurs envoient leur message suivant dès la réponse reçue.
+
+    Par mention, chaque utilisateur a son salon ; en mode salon cible, tous partagent le salon cible."""
+    recorder = Recorder()
+    guild = FakeGuild(1)
+    per_user = max(1, messages // concurrency)
+    shared = FakeChannel(target_channel_id, guild, recorder, coalesced=bot_module.COALESCE_TARGET_CHANNEL)
+
+    async def user_loop(index):
+        channel = shared if use_target_channel else FakeChannel(10_000 + index, guild, recorder)
+        author = FakeUser(f"user{index}")
+        for n in range(per_user):
+            content = f"question {n} de {author.name} sur un sujet quelconque"
+            if not use_target_channel: content = f"<@{bot_user.id}> {content}"
+            message = FakeMessage(channel, author, content)
+            await bot_module.on_message(message)
+            deadline = time.perf_counter() + 30
+            while message.id not in recorder.first_reply and time.perf_counter() < deadline and use_target_channel:
+                await asyncio.sleep(0.01)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user_loop(i) for i in range(concurrency)))
+    await drain(bot.conversation_log._writer_task, lag_task)
+    return recorder, per_user * concurrency, time.perf_counter() - start
+
+
+async def run_replay(bot, bot_user, path: str, speed: float, target_channel_id: int, lag_task=None):
+    recorder = Recorder()
+    guild = FakeGuild(1)
+    channels = {}; users = {}
+    events = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line: events.append(json.loads(line))
+
+    tasks = []; sent = 0; offset = 0.0
+    start = time.perf_counter()
+    for event in events:
+        offset = event.get("t", offset + 0.2)
+        delay = offset / speed - (time.perf_counter() - start)
+        if delay > 0: await asyncio.sleep(delay)
+        channel_id = event.get("channel", target_channel_id)
+        channel = channels.get(channel_id) or channels.setdefault(channel_id, FakeChannel(
+            channel_id, guild, recorder, coalesced=channel_id == target_channel_id and bot_module.COALESCE_TARGET_CHANNEL))
+        author_name = event.get("author", "replay")
+        author = users.get(author_name) or users.setdefault(author_name, FakeUser(author_name))
+        if "command" in event:
+            tasks.append(asyncio.ensure_future(run_command(bot, event["command"], event.get("args", {}), author, channel)))
+            continue
+        content = event.get("content") or "\n".join(filter(None, [event.get("title"), event.get("body")]))
+        if event.get("mention", channel_id != target_channel_id): content = f"<@{bot_user.id}> {content}"
+        tasks.append(asyncio.ensure_future(bot_module.on_message(FakeMessage(channel, author, content))))
+        sent += 1
+    await asyncio.gather(*tasks)
+    await drain(bot.conversation_log._writer_task, lag_task)
+    return recorder, sent, time.perf_counter() - start
+
+
+async def run_command(bot, name: str, args: dict, author: FakeUser, channel: FakeChannel):
+    command = bot.tree.get_command(name)
+    if command is None: logging.warning(f"Commande inconnue dans le rejeu: {name}"); return None
+    interaction = FakeInteraction(author, channel)
+    start = time.perf_counter()
+    await command.callback(interaction, **args)
+    return time.perf_counter() - start
+
+
+async def run_commands_bench(bot, iterations: int):
+    """Temps des commandes slash les plus fréquentes, hors réseau."""
+    channel = FakeChannel(42, FakeGuild(1), Recorder())
+    author = FakeUser("admin")
+    persona_ids = [pid for pid in bot.personas if pid != "default"] or ["default"]
+    timings = {"personas": [], "persona_set": [], "autocomplete": []}
+    for i in range(iterations):
+        timings["personas"].append(await run_command(bot, "personas", {}, author, channel))
+        timings["persona_set"].append(await run_command(bot, "persona_set", {"persona_id": persona_ids[i % len(persona_ids)]}, author, channel))
+        command = bot.tree.get_command("persona_set")
+        autocomplete = command._params["persona_id"].autocomplete
+        start = time.perf_counter()
+        await autocomplete(FakeInteraction(author, channel), "fe")
+        timings["autocomplete"].append(time.perf_counter() - start)
+    return timings
+
+
+def report(label: str, backend: FakeBackend, recorder: Recorder, sent: int, elapsed: float, lag: LoopLagSampler):
+    latencies = list(recorder.first_reply.values())
+    prompts = backend.prompt_chars
+    row = {
+        "scenario": label,
+        "messages": sent,
+        "replies": len(latencies),
+        "llm_calls": backend.calls,
+        "errors_injected": backend.errors,
+        "busy": recorder.busy,
+        "throughput_msg_s": round(sent / elapsed, 2) if elapsed else 0.0,
+        "reply_p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "reply_p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "reply_p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "prompt_chars_mean": round(statistics.mean(prompts)) if prompts else 0,
+        "prompt_chars_max": max(prompts) if prompts else 0,
+        "loop_lag_p99_ms": round(percentile(lag.samples, 0.99) * 1000, 2),
+        "loop_lag_max_ms": round(max(lag.samples, default=0.0) * 1000, 2),
+        "discord_edits": recorder.edits,
+    }
+    return row
+
+
+def print_table(rows):
+    if not rows: return
+    columns = list(rows[0].keys())
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for r in rows: print("  ".join(str(r[c]).ljust(widths[c]) for c in columns))
+
+
+async def main(args):
+    logging.getLogger().setLevel(logging.WARNING if not args.verbose else logging.INFO)
+    target_channel_id = 999
+    rows = []
+    bot, bot_user = None, None
+    for level in [int(c) for c in args.concurrency.split(",")]:
+        backend = FakeBackend(latency=args.latency, token_rate=args.token_rate, error_rate=args.error_rate,
+                              response_tokens=args.response_tokens, seed=args.seed)
+        bot, bot_user = prepare_bot(backend, stream=args.stream, coalesce=args.coalesce, target_channel_id=target_channel_id)
+        if bot.conversation_log._writer_task is None: await bot.conversation_log.start()
+        reset_state(bot)
+        lag = LoopLagSampler(); lag.start()
+        if args.replay:
+            recorder, sent, elapsed = await run_replay(bot, bot_user, args.replay, args.speed, target_channel_id, lag._task)
+            label = f"replay x{args.speed} ({os.path.basename(args.replay)})"
+        else:
+            recorder, sent, elapsed = await run_closed_loop(bot, bot_user, level, args.messages, args.target_channel, target_channel_id, lag._task)
+            label = f"concurrency={level}"
+        await lag.stop()
+        rows.append(report(label, backend, recorder, sent, elapsed, lag))
+        if args.replay: break
+
+    print_table(rows)
+    if args.commands and bot is not None:
+        timings = await run_commands_bench(bot, args.command_iterations)
+        print()
+        for name, values in timings.items():
+            print(f"/{name}: p50 {percentile(values, 0.5) * 1000:.2f}ms  p95 {percentile(values, 0.95) * 1000:.2f}ms  ({len(values)} appels)")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f: json.dump(rows, f, ensure_ascii=False, indent=2)
+    if bot is not None: await bot.conversation_log.close()
+    shutil.rmtree(_TMP, ignore_errors=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark hors ligne de Fent-Droid (faux Discord + faux Gemini).")
+    parser.add_argument("--concurrency", default="1,4,16", help="niveaux de concurrence, séparés par des virgules")
+    parser.add_argument("--messages", type=int, default=200, help="messages par niveau de concurrence")
+    parser.add_argument("--latency", type=float, default=0.3, help="latence du faux Gemini jusqu'au premier token (s)")
+    parser.add_argument("--token-rate", type=float, default=80, help="débit du faux Gemini (tokens/s)")
+    parser.add_argument("--response-tokens", type=int, default=120, help="longueur des réponses (tokens)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="proportion d'appels en erreur 503")
+    parser.add_argument("--stream", action=argparse.BooleanOptionalAction, default=True, help="réponses streamées")
+    parser.add_argument("--target-channel", action="store_true", help="envoyer dans le salon cible plutôt que par mention")
+    parser.add_argument("--coalesce", action=argparse.BooleanOptionalAction, default=True, help="regroupement des rafales du salon cible")
+    parser.add_argument("--replay", help="fichier JSONL de trafic à rejouer")
+    parser.add_argument("--speed", type=float, default=1.0, help="accélération du rejeu")
+    parser.add_argument("--commands", action="store_true", help="mesurer aussi les commandes slash")
+    parser.add_argument("--command-iterations", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="écrire les résultats dans ce fichier JSON")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
+    sys.exit(0)
@@ -1,12 +1,30 @@
 import os
+import sys
+import asyncio
 import logging
-import json
+import time
+from contextlib import aclosing, asynccontextmanager
 from dotenv import load_dotenv
 import discord
 from discord.ext import commands
-import google.generativeai as genai
-import datetime
-from datetime import timezone
+from conversation_store import ConversationStore
+from scheduler import Scheduler, SchedulerBusy
+from streaming import StreamingReply
+from model_pool import ModelPool, prompt_hash
+from history_window import HistoryWindow, TokenEstimator
+from state_backend import make_backend
+from persona_repository import PersonaRepository
+from persona_registry import PersonaIndex
+from response_cache import ResponseCache
+from gemini_client import GeminiClient, GeminiUnavailable, ThreadedModel
+from coalescer import BurstCoalescer
+from metrics import Metrics, HealthServer, RateLimitLogHandler
+from commands import setup as setup_commands, sync_if_changed
+from attachments import AttachmentStore
+
+# Lancé en script, ce module s'appelle __main__ : un `import bot` ailleurs en referait une seconde copie
+# (second client, personas rechargées...). On l'enregistre aussi sous son nom.
+if __name__ == "__main__": sys.modules.setdefault("bot", sys.modules[__name__])
 
 
 logging.basicConfig(level=logging.INFO,
@@ -15,189 +33,432 @@ logging.basicConfig(level=logging.INFO,
 load_dotenv()
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-TARGET_CHANNEL_ID = int(os.getenv("TARGET_CHANNEL_ID", "0"))
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+TARGET_CHANNEL_ID = int(os.getenv("TARGET_CHANNEL_ID") or "0")
 PERSONAS_FILE = "personas.json"
+PROMPT_FILE = "prompt.txt"
+CONVERSATIONS_DB = os.getenv("CONVERSATIONS_DB", "conversations.db")
+COMMAND_TREE_HASH_FILE = ".command_tree_hash"
 CONTEXT_TIMEOUT_MINUTES = 2
-MAX_HISTORY_ITEMS = 20
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")  # "sqlite" (partagé entre processus) ou "memory"
+SHARD_COUNT = int(os.getenv("SHARD_COUNT") or "0") or None  # None = nombre recommandé par Discord
+SHARD_IDS = [int(i) for i in os.getenv("SHARD_IDS", "").split(",") if i.strip()] or None  # fixés par supervisor.py
+WORKER_ID = os.getenv("WORKER_ID", "0")
+MAX_HISTORY_ITEMS = 200
+HISTORY_TOKEN_BUDGET = 6000
+SUMMARY_MAX_WORDS = 200
+SUMMARY_BATCH_TOKENS = 4000  # tours évincés intégrés par appel de résumé
+SUMMARY_BACKLOG_MAX_TOKENS = 16000  # au-delà (résumés en échec), les plus anciens tours évincés sont abandonnés
+TOKEN_CALIBRATION_RATE = 0.02
+LOG_FLUSH_INTERVAL_SECONDS = 1.0
+LOG_COMPACT_INTERVAL_MINUTES = 10
+PERSONAS_SAVE_DELAY_SECONDS = 1.0
+PERSONAS_RELOAD_INTERVAL_SECONDS = 5.0
+RESPONSE_CACHE_MAX_ENTRIES = 1000
+RESPONSE_CACHE_MAX_CHARS = 2_000_000
+RESPONSE_CACHE_TTL_SECONDS = 600
+RESPONSE_CACHE_TAIL_ITEMS = 2
+MAX_CONVERSATIONS = 1000
+MAX_CONCURRENT_LLM_REQUESTS = 4
+MAX_WAITING_LLM_REQUESTS = 32
+STREAM_RESPONSES = True
+COALESCE_TARGET_CHANNEL = True
+COALESCE_MIN_WINDOW_SECONDS = 0.6
+COALESCE_MAX_WINDOW_SECONDS = 3.0
+COALESCE_MAX_BATCH = 10
+STREAM_EDIT_INTERVAL_SECONDS = 1.2
+GEMINI_MODELS = [m.strip() for m in os.getenv("GEMINI_MODELS", "gemini-2.5-flash,gemini-2.5-flash-lite").split(",") if m.strip()]
+GEMINI_MODEL_NAME = GEMINI_MODELS[0]
+GEMINI_DEADLINE_SECONDS = 60
+GEMINI_MAX_ATTEMPTS = 3
+GEMINI_BREAKER_FAILURES = 5
+GEMINI_BREAKER_RESET_SECONDS = 30
+GEMINI_FALLBACK_P95_SECONDS = 20
+GEMINI_FALLBACK_ERROR_RATE = 0.5
+MAX_PERSONA_MODELS = 32
+PROMPT_CACHE_MIN_CHARS = 4000
+PROMPT_CACHE_TTL_MINUTES = 60
+ATTACHMENT_MAX_BYTES = 8 * 1024 * 1024
+ATTACHMENT_MAX_COUNT = 4
+ATTACHMENT_MAX_TEXT_CHARS = 20000
+ATTACHMENT_INLINE_MAX_BYTES = 256 * 1024  # au-delà : API Files de Gemini (envoi unique, référence réutilisée)
+ATTACHMENT_CACHE_DIR = os.path.join(".attachment_cache", WORKER_ID)
+ATTACHMENT_CACHE_MAX_BYTES = 200 * 1024 * 1024
+ATTACHMENT_CACHE_TTL_HOURS = 24
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT") or "9108")  # 0 = endpoint désactivé
+LOG_SAMPLE_RATE = 0.01
+
+model = None  # créé par init_gemini()
+
+
+def init_gemini():
+    """Importe et configure le SDK Gemini (~1 s d'import) ; lancée dans un thread pendant la connexion à Discord."""
+    global model
+    import google.generativeai as genai
+    if GEMINI_API_ENDPOINT: genai.configure(api_key=GEMINI_API_KEY, transport="rest", client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+    else: genai.configure(api_key=GEMINI_API_KEY)
+    try:
+        model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+        if GEMINI_API_ENDPOINT: model = ThreadedModel(model)  # le transport REST n'a pas de méthodes *_async
+    except Exception as e: logging.error(f"Erreur init Gemini: {e}"); model = None
+    bot.history.summary_model = model
+    return model
+
 
-genai.configure(api_key=GEMINI_API_KEY)
-try: model = genai.GenerativeModel('gemini-2.5-flash')
-except Exception as e: logging.error(f"Erreur init Gemini: {e}"); model = None
+async def gemini_model():
+    """Le modèle par défaut, en attendant si besoin la fin de init_gemini()."""
+    if model is None and bot.gemini_init is not None: await bot.gemini_init
+    return model
 
 
 def load_personas(bot_ref: commands.Bot):
     """Charge les personnalités depuis les fichiers dans bot_ref.personas."""
-    logging.info("Début chargement personnalités...")
+    bot_ref.personas = bot_ref.persona_repo.load()
+
+
+def save_personas(bot_ref: commands.Bot):
+    """Programme la sauvegarde (différée, atomique) de bot_ref.personas dans le fichier JSON."""
+    bot_ref.persona_repo.save()
+
+
+def on_personas_changed(changed, removed):
+    """Appelée après un rechargement à chaud : n'invalide que ce qui dépend des personas modifiées."""
+    for persona_id in changed | removed: bot.models.invalidate(persona_id)
+    for persona_id in removed: bot.persona_index.remove(persona_id)
+    for persona_id in changed: bot.persona_index.update(persona_id, bot.personas[persona_id])
+    for persona_id in removed:
+        count = bot.conversations.reset_persona_everywhere(persona_id, "default")
+        if count: logging.info(f"Persona '{persona_id}' supprimée du fichier: {count} conversation(s) remise(s) sur 'default'.")
 
-    bot_ref.personas = {
-        "default": {"name": "Fent-Droid (Défaut)", "description": "Base", "prompt": "IA de base."}
+
+def on_personas_saved(changed, removed):
+    """Nos modifications sont sur disque : on prévient les autres processus (shards)."""
+    bot.state.publish_personas(changed, removed)
+
+
+async def on_remote_personas_changed(changed, removed):
+    """Un autre processus a modifié des personas : relecture immédiate, sans attendre le watcher."""
+    await bot.persona_repo.reload_if_changed()
+
+
+def worker_status() -> dict:
+    """Statut de ce processus, publié dans l'état partagé pour la vue agrégée (supervisor.py, /ping)."""
+    return {
+        "pid": os.getpid(), "ready": bot.is_ready(), "shard_count": bot.shard_count,
+        "shards": {str(shard_id): {"ready": not shard.is_closed(), "latency_ms": shard.latency * 1000}
+                   for shard_id, shard in bot.shards.items()},
+        "guilds": len(bot.guilds), "conversations": len(bot.conversations), "personas": len(bot.personas),
+        "scheduler": bot.scheduler.stats(), "response_cache": bot.response_cache.stats(),
+        "gemini": {name: status["circuit"] for name, status in bot.gemini.status().items()},
     }
 
-    try:
-        with open("prompt.txt", "r", encoding="utf-8") as f:
-            default_prompt = f.read().strip()
-            if default_prompt:
-                bot_ref.personas["default"]["prompt"] = default_prompt
-                logging.info("Prompt default chargé depuis prompt.txt.")
-            else: logging.warning("prompt.txt vide.")
-    except FileNotFoundError: logging.warning("prompt.txt non trouvé.")
-    except Exception as e: logging.error(f"Erreur lecture prompt.txt: {e}")
 
-    try:
-        if os.path.exists(PERSONAS_FILE):
-            logging.info(f"Chargement {PERSONAS_FILE}...")
-            with open(PERSONAS_FILE, 'r', encoding='utf-8') as f:
-                loaded = json.load(f)
-                if isinstance(loaded, dict):
-                    
-                    valid_personas = {k: v for k, v in loaded.items() if isinstance(v, dict)}
-                    default_in_file = valid_personas.pop('default', None) 
-                    bot_ref.personas.update(valid_personas) 
-                    if default_in_file:
-                        if 'prompt' not in default_in_file or not default_in_file['prompt']:
-                            default_in_file['prompt'] = bot_ref.personas['default']['prompt']
-                        bot_ref.personas['default'].update(default_in_file)
-
-                    logging.info(f"{len(valid_personas)} (+default) personnalités chargées/mises à jour depuis {PERSONAS_FILE}.")
-                else: logging.warning(f"Format incorrect {PERSONAS_FILE}.")
-            logging.info(f"Clés dans bot.personas après chargement : {list(bot_ref.personas.keys())}")
-        else:
-            logging.info(f"{PERSONAS_FILE} non trouvé. Création avec default seulement.")
-            save_personas(bot_ref)
-    except json.JSONDecodeError as e: logging.error(f"Erreur JSON {PERSONAS_FILE}: {e}")
-    except Exception as e: logging.error(f"Erreur chargement {PERSONAS_FILE}: {e}")
+def format_user_turn(author_name: str, user_message: str) -> str:
+    return f"Msg ({author_name}): {user_message}"
 
 
-def save_personas(bot_ref: commands.Bot):
-    """Sauvegarde le contenu de bot_ref.personas dans le fichier JSON."""
-    try:
-        logging.info(f"Sauvegarde de bot.personas dans {PERSONAS_FILE}...")
-        personas_to_save = getattr(bot_ref, 'personas', {})
-        if not isinstance(personas_to_save, dict):
-             logging.error(f"Tentative de sauvegarde d'un type invalide pour personas: {type(personas_to_save)}")
-             return
-
-        with open(PERSONAS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(personas_to_save, f, ensure_ascii=False, indent=4)
-        logging.info(f"Sauvegarde réussie. Clés actuelles dans bot.personas: {list(personas_to_save.keys())}")
-    except Exception as e:
-        logging.error(f"Erreur lors de la sauvegarde de bot.personas: {e}")
-
-
-def format_history_for_prompt(history):
-
-    if not history: return "Pas d'historique récent."
-    formatted = ""
-    for msg in history:
-        role = msg.get("role", "unknown").replace("model", "Fent-Droid").replace("user", "User")
-        parts = msg.get("parts", [""])
-        content = " ".join(parts)
-        formatted += f"{role}: {content}\n"
-    return formatted.strip()
+async def build_contents(conversation, user_turn: str):
+    """Construit les `contents` multi-tours Gemini : résumé glissant, fenêtre d'historique puis nouveau message.
+
+    Les marqueurs de pièces jointes de l'historique sont remplacés par leur contenu (depuis le cache)."""
+    bot.history.fit(conversation, reserve_tokens=bot.history.estimator.estimate(user_turn))
+    prefix = bot.history.contents_prefix(conversation)
+    return await bot.attachments.expand(prefix + list(conversation.history) + [{"role": "user", "parts": [user_turn]}])
+
+
+def commit_turn(conversation, user_turn: str, response_text: str):
+    """Ajoute l'échange à l'historique puis lance, hors chemin de réponse, résumé et calibration."""
+    conversation.append_turn(user_turn, response_text)
+    bot.history.fit(conversation)
+    bot.history.schedule_summary(conversation)
+    bot.history.estimator.maybe_calibrate(model, user_turn + response_text)
+
+
+async def respond_burst(key, items):
+    """Traite une rafale du salon cible comme un seul tour multi-interlocuteurs, en répondant au dernier message."""
+    await handle_turn(items[-1][0], items)
+
+
+async def turn_text(items):
+    """Texte du tour (message seul et version signée pour Gemini), avec les marqueurs des pièces jointes.
+
+    Appelée une fois le tour de la conversation acquis : un gros fichier ne fait pas doubler le message suivant,
+    et rien n'est téléchargé pour un tour rejeté par le scheduler."""
+    texts = []
+    for message, text in items:
+        if message.attachments: text = "\n".join([text, *await bot.attachments.ingest(message.attachments)]).strip()
+        texts.append((message, text))
+    return ("\n".join(text for _, text in texts),
+            "\n".join(format_user_turn(m.author.display_name, text) for m, text in texts))
+
+
+def collect_metrics():
+    """Recopie dans les jauges l'état courant du scheduler, du cache, des conversations et de Gemini."""
+    m = bot.metrics
+    for name, value in bot.scheduler.stats().items(): m.scheduler.set(value, name)
+    cache = bot.response_cache.stats()
+    m.cache_hits.set(cache["hits"]); m.cache_misses.set(cache["misses"]); m.cache_entries.set(cache["entries"])
+    m.conversations.set(len(bot.conversations))
+    for name, value in bot.attachments.stats().items(): m.attachments.set(value, name)
+    for name, status in bot.gemini.status().items(): m.gemini_circuit_open.set(int(status["circuit"] == "open"), name)
+
+
+def readiness() -> dict:
+    return {"discord": bot.is_ready(), "state": bot.state.running,
+            "gemini": any(breaker.state != "open" for breaker in bot.gemini.breakers.values())}
+
+
+class FentDroidBot(commands.AutoShardedBot):
+    """Un seul processus gère tous les shards par défaut ; supervisor.py en répartit des groupes sur plusieurs processus."""
+
+    async def setup_hook(self):
+        """Appelée une seule fois par processus (après le login, avant la gateway), contrairement à on_ready."""
+        self.gemini_init = asyncio.get_running_loop().run_in_executor(None, init_gemini)
+        try: setup_commands(self); logging.info("Commandes chargées.")
+        except Exception as e: logging.exception("Erreur chargement commandes:")
+        if WORKER_ID == "0":
+            try: await sync_if_changed(self, COMMAND_TREE_HASH_FILE)
+            except Exception as e: logging.error(f"Erreur sync commandes: {e}")
+        await self.state.start()
+        self.persona_repo.start_watching()
+        self.metrics.start_loop_lag_sampler()
+        if METRICS_PORT:
+            try: await self.health_server.start()
+            except OSError as e: logging.error(f"Endpoint métriques indisponible sur le port {METRICS_PORT}: {e}")
+
+    async def close(self):
+        self.metrics.stop_loop_lag_sampler()
+        try: await self.health_server.stop()
+        except Exception as e: logging.error(f"Erreur arrêt endpoint métriques: {e}")
+        self.persona_repo.stop_watching()
+        try: await self.persona_repo.flush()
+        except Exception as e: logging.error(f"Erreur sauvegarde finale des personnalités: {e}")
+        try: await self.attachments.close()
+        except Exception as e: logging.error(f"Erreur fermeture du cache des pièces jointes: {e}")
+        try: await self.state.close()
+        except Exception as e: logging.error(f"Erreur fermeture de l'état partagé: {e}")
+        await super().close()
+
 
 intents = discord.Intents.default(); intents.message_content = True
-bot = commands.Bot(command_prefix=commands.when_mentioned_or("!"), intents=intents)
+bot = FentDroidBot(command_prefix=commands.when_mentioned_or("!"), intents=intents, shard_ids=SHARD_IDS, shard_count=SHARD_COUNT,
+                   activity=discord.Activity(type=discord.ActivityType.listening, name="vos messages"))
+bot.gemini_init = None
 
 
+bot.persona_repo = PersonaRepository(PERSONAS_FILE, PROMPT_FILE, save_delay=PERSONAS_SAVE_DELAY_SECONDS,
+                                     reload_interval=PERSONAS_RELOAD_INTERVAL_SECONDS, on_change=on_personas_changed,
+                                     on_saved=on_personas_saved)
 bot.personas = {} 
-bot.active_persona_id = "default" 
-bot.conversation_history = []
-bot.last_message_timestamp = None
+bot.conversations = ConversationStore(max_items=MAX_HISTORY_ITEMS, timeout_minutes=CONTEXT_TIMEOUT_MINUTES,
+                                      max_conversations=MAX_CONVERSATIONS, default_persona_id="default")
+bot.state = make_backend(STATE_BACKEND, CONVERSATIONS_DB, worker_id=WORKER_ID, on_persona_event=on_remote_personas_changed,
+                         status_provider=worker_status,
+                         log_options=dict(flush_interval=LOG_FLUSH_INTERVAL_SECONDS, retention_minutes=CONTEXT_TIMEOUT_MINUTES,
+                                          compact_interval_minutes=LOG_COMPACT_INTERVAL_MINUTES, max_load_items=MAX_HISTORY_ITEMS))
+bot.conversation_log = bot.state.conversation_log
+bot.conversations.log = bot.conversation_log
+bot.scheduler = Scheduler(max_concurrent=MAX_CONCURRENT_LLM_REQUESTS, max_waiting=MAX_WAITING_LLM_REQUESTS)
+bot.models = ModelPool(GEMINI_MODEL_NAME, max_models=MAX_PERSONA_MODELS, cache_min_chars=PROMPT_CACHE_MIN_CHARS,
+                       cache_ttl_minutes=PROMPT_CACHE_TTL_MINUTES, wrap_model=ThreadedModel if GEMINI_API_ENDPOINT else None)
+bot.gemini = GeminiClient(GEMINI_MODELS, deadline=GEMINI_DEADLINE_SECONDS, max_attempts=GEMINI_MAX_ATTEMPTS,
+                          failure_threshold=GEMINI_BREAKER_FAILURES, reset_timeout=GEMINI_BREAKER_RESET_SECONDS,
+                          p95_threshold=GEMINI_FALLBACK_P95_SECONDS, error_rate_threshold=GEMINI_FALLBACK_ERROR_RATE,
+                          slot=lambda: llm_slot())  # place LLM prise à chaque essai, rendue pendant le backoff
+bot.coalescer = BurstCoalescer(respond_burst, min_window=COALESCE_MIN_WINDOW_SECONDS,
+                               max_window=COALESCE_MAX_WINDOW_SECONDS, max_batch=COALESCE_MAX_BATCH)
+bot.response_cache = ResponseCache(max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_chars=RESPONSE_CACHE_MAX_CHARS,
+                                   ttl_seconds=RESPONSE_CACHE_TTL_SECONDS, tail_items=RESPONSE_CACHE_TAIL_ITEMS)
+bot.history = HistoryWindow(model, token_budget=HISTORY_TOKEN_BUDGET, summary_max_words=SUMMARY_MAX_WORDS,
+                            estimator=TokenEstimator(calibration_rate=TOKEN_CALIBRATION_RATE), scheduler=bot.scheduler,
+                            summary_batch_tokens=SUMMARY_BATCH_TOKENS, max_evicted_tokens=SUMMARY_BACKLOG_MAX_TOKENS)
+bot.attachments = AttachmentStore(ATTACHMENT_CACHE_DIR, max_bytes=ATTACHMENT_MAX_BYTES, max_count=ATTACHMENT_MAX_COUNT,
+                                  max_text_chars=ATTACHMENT_MAX_TEXT_CHARS, inline_max_bytes=ATTACHMENT_INLINE_MAX_BYTES,
+                                  disk_budget_bytes=ATTACHMENT_CACHE_MAX_BYTES, ttl_hours=ATTACHMENT_CACHE_TTL_HOURS)
+bot.history.estimator.extra_tokens = bot.attachments.estimate_tokens  # le budget compte les pièces jointes développées
+bot.metrics = Metrics(log_sample_rate=LOG_SAMPLE_RATE)
+bot.metrics.scheduler = bot.metrics.gauge("fentdroid_scheduler", "Statistiques du scheduler (file, en cours, délestés, p50/p95).", labels=("stat",))
+bot.metrics.cache_hits = bot.metrics.counter("fentdroid_response_cache_hits_total", "Réponses servies par le cache.")
+bot.metrics.cache_misses = bot.metrics.counter("fentdroid_response_cache_misses_total", "Recherches dans le cache sans résultat.")
+bot.metrics.cache_entries = bot.metrics.gauge("fentdroid_response_cache_entries", "Entrées dans le cache de réponses.")
+bot.metrics.conversations = bot.metrics.gauge("fentdroid_conversations", "Conversations en mémoire.")
+bot.metrics.gemini_circuit_open = bot.metrics.gauge("fentdroid_gemini_circuit_open", "Disjoncteur Gemini ouvert (1) ou non (0).", labels=("model",))
+bot.metrics.attachments = bot.metrics.gauge("fentdroid_attachments", "Cache des pièces jointes (entrées, octets, téléchargements, doublons, envois).", labels=("stat",))
+bot.metrics.add_collector(collect_metrics)
+bot.health_server = HealthServer(bot.metrics, readiness, host=METRICS_HOST, port=METRICS_PORT)
+logging.getLogger("discord.http").addHandler(RateLimitLogHandler(bot.metrics.discord_rate_limited))
 
 load_personas(bot)
+bot.attachments.load()
 
-if bot.active_persona_id not in bot.personas:
-    logging.warning(f"ID actif initial '{bot.active_persona_id}' invalide après chargement. Retour à 'default'.")
-    bot.active_persona_id = "default"
-    if "default" not in bot.personas:
-         logging.critical("ERREUR: Personnalité 'default' non trouvée après chargement initial !")
-         bot.personas['default'] = {"name":"Fallback Default","description":"Fallback","prompt":"Fallback IA"}
-         bot.active_persona_id = "default"
+if "default" not in bot.personas:
+     logging.critical("ERREUR: Personnalité 'default' non trouvée après chargement initial !")
+     bot.personas['default'] = {"name":"Fallback Default","description":"Fallback","prompt":"Fallback IA"}
+bot.persona_index = PersonaIndex(bot.personas)
 
-logging.info(f"État initialisé: Persona='{bot.active_persona_id}', History=[], Timestamp=None")
-logging.info(f"Clés Personas initiales sur bot: {list(bot.personas.keys())}")
+logging.info(f"État initialisé: Persona par défaut='default', max conversations={MAX_CONVERSATIONS}, "
+             f"backend={STATE_BACKEND}, processus={WORKER_ID}, shards={SHARD_IDS or 'auto'}/{SHARD_COUNT or 'auto'}")
+logging.info(f"Personas initiales sur bot: {len(bot.personas)}")
 
 @bot.event
 async def on_ready():
+    """Appelée à chaque (re)connexion : rien de coûteux ici (commandes et présence sont gérées une fois pour toutes)."""
     logging.info(f'Bot connecté: {bot.user}')
-    if not DISCORD_TOKEN or not GEMINI_API_KEY or not model: await bot.close(); return
-    from commands import setup as setup_commands
-    try: setup_commands(bot); logging.info("Commandes chargées.")
-    except Exception as e: logging.exception("Erreur chargement commandes:")
-    try: synced = await bot.tree.sync(); logging.info(f"Commandes sync ({len(synced)})")
-    except Exception as e: logging.error(f"Erreur sync commandes: {e}")
-    await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.listening, name="vos messages"))
-    logging.info(f"Bot prêt. État: bot.active_persona_id: {bot.active_persona_id}, bot.personas keys: {list(bot.personas.keys())}")
+    if not DISCORD_TOKEN or not GEMINI_API_KEY or not await gemini_model(): await bot.close(); return
+    logging.info(f"Bot prêt. Conversations actives: {len(bot.conversations)}, personas: {len(bot.personas)}")
 
 
 @bot.event
 async def on_message(message):
     if message.author == bot.user or isinstance(message.channel, discord.DMChannel): return
 
-    now = datetime.datetime.now(timezone.utc)
-    reset_due_to_timeout = False 
-    if bot.last_message_timestamp:
-        time_diff = now - bot.last_message_timestamp
-        if time_diff > datetime.timedelta(minutes=CONTEXT_TIMEOUT_MINUTES):
-            logging.info(f"Inactivité détectée ({time_diff}). Reset historique et persona.")
-            bot.conversation_history = []
-            bot.active_persona_id = "default"
-            reset_due_to_timeout = True 
-
-    should_respond = False; user_message = message.content
+    should_respond = False; coalesce = False; user_message = message.content
     if bot.user.mentioned_in(message):
         should_respond = True; user_message = message.content.replace(f'<@!{bot.user.id}>', '').replace(f'<@{bot.user.id}>', '').strip()
-        if not user_message: return
-    elif TARGET_CHANNEL_ID != 0 and message.channel.id == TARGET_CHANNEL_ID: should_respond = True
+        if not user_message and not message.attachments: return
+    elif TARGET_CHANNEL_ID != 0 and message.channel.id == TARGET_CHANNEL_ID:
+        should_respond = True; coalesce = COALESCE_TARGET_CHANNEL
     if not should_respond: return
-    if not model: await message.channel.send("Cerveau IA non dispo."); return
+    if coalesce:
+        bot.coalescer.submit(bot.conversations.key_for_message(message), (message, user_message)); return
+    await handle_turn(message, [(message, user_message)])
+
 
+async def handle_turn(message, items):
+    """Un tour de conversation : `items` = [(message, texte)], plusieurs pour une rafale ; la réponse va à `message`."""
+    if not await gemini_model(): await message.channel.send("Cerveau IA non dispo."); return
+
+    conversation = await bot.conversations.load(bot.conversations.key_for_message(message))
+
+    queued_at = time.monotonic()
     try:
-        current_persona_id = bot.active_persona_id
+        async with bot.scheduler.slot(conversation.key):
+            bot.metrics.queue_wait.observe(time.monotonic() - queued_at, "turn")
+            user_message, user_turn = await turn_text(items)
+            await respond(message, conversation, user_message, user_turn)
+    except SchedulerBusy:
+        bot.metrics.replies.inc(1, "busy")
+        await message.reply("Trop de demandes en cours, réessaie dans un instant.", mention_author=False)
+
+
+async def respond(message, conversation, user_message: str, user_turn: str = None):
+    """Génère et envoie la réponse à un message. Appelée avec le tour de la conversation acquis."""
+    user_turn = user_turn or format_user_turn(message.author.display_name, user_message)
+    if conversation.is_expired():
+        logging.info(f"Inactivité détectée pour {conversation.key}. Reset historique et persona.")
+        conversation.reset("default")
+
+    try:
+        current_persona_id = conversation.persona_id
         personas_dict = bot.personas
-        logging.info(f"Réponse avec persona_id='{current_persona_id}' depuis bot.personas")
 
         if current_persona_id in personas_dict:
             active_persona_data = personas_dict[current_persona_id]
             retrieved_id_for_log = current_persona_id
         else:
-            logging.warning(f"ID actif '{current_persona_id}' NON TROUVÉ dans bot.personas ({list(personas_dict.keys())}). Fallback 'default'.")
+            logging.warning(f"ID actif '{current_persona_id}' NON TROUVÉ dans bot.personas ({len(personas_dict)} personas). Fallback 'default'.")
             active_persona_data = personas_dict.get("default")
             if not active_persona_data:
                  logging.error("CRITIQUE: 'default' non trouvé dans bot.personas pour fallback.")
                  await message.channel.send("Erreur config personnalité (default manquant).")
                  return
-            bot.active_persona_id = "default"
+            conversation.persona_id = "default"
             retrieved_id_for_log = "default (fallback)"
 
-        logging.info(f"Données utilisées: ID={retrieved_id_for_log}")
+        logging.debug(f"Données utilisées: ID={retrieved_id_for_log}")
         active_prompt = active_persona_data.get("prompt", "Prompt manquant.")
 
-        history_string = format_history_for_prompt(bot.conversation_history)
-        contextual_prompt = f"{active_prompt}\n\n--- HISTORIQUE ---\n{history_string}\n--- FIN HISTORIQUE ---\n\nMsg ({message.author.display_name}): {user_message}\n\nFent-Droid:"
-        logging.info(f"Prompt Gemini (début): {contextual_prompt[:300]}...")
+        cache_key = None
+        if ResponseCache.enabled_for(active_persona_data):
+            cache_key = bot.response_cache.key(conversation.persona_id, prompt_hash(active_prompt), conversation.history, user_message)
+            cached_text = bot.response_cache.get(cache_key)
+            if cached_text is not None:
+                commit_turn(conversation, user_turn, cached_text)
+                bot.metrics.replies.inc(1, "cache_hit")
+                bot.metrics.sample_log("turn", key=conversation.key, persona=conversation.persona_id, outcome="cache_hit")
+                await send_chunks(message, cached_text)
+                return
+
+        persona_id = conversation.persona_id
+        def persona_model(model_name): return bot.models.get(persona_id, active_prompt, model_name)
+        contents = await build_contents(conversation, user_turn)
+        prompt_chars = contents_chars(contents)
+        bot.metrics.prompt_chars.observe(prompt_chars)
+        bot.metrics.history_items.observe(len(conversation.history))
 
         async with message.channel.typing():
-            response = await model.generate_content_async(contextual_prompt)
+            if STREAM_RESPONSES:
+                response_text = await respond_streaming(message, conversation, user_turn, persona_model, contents)
+                if cache_key and response_text: bot.response_cache.put(cache_key, response_text)
+                return
+            started = time.monotonic()
+            response = await bot.gemini.generate(persona_model, contents)
+            bot.metrics.gemini_latency.observe(time.monotonic() - started, "generate")
             if not response.parts:
-                 logging.warning(f"Réponse Gemini bloquée/vide pour: '{user_message}'"); await message.channel.send("Je... bloque."); return
+                 logging.warning(f"Réponse Gemini bloquée/vide ({len(user_message)} caractères).")
+                 bot.metrics.replies.inc(1, "blocked"); await message.channel.send("Je... bloque."); return
             response_text = response.text
 
-            bot.conversation_history.append({"role": "user", "parts": [user_message]})
-            bot.conversation_history.append({"role": "model", "parts": [response_text]})
-            if len(bot.conversation_history) > MAX_HISTORY_ITEMS:
-                bot.conversation_history = bot.conversation_history[-MAX_HISTORY_ITEMS:]
-                logging.info(f"Historique limité à {MAX_HISTORY_ITEMS} items.")
+            commit_turn(conversation, user_turn, response_text)
+            if cache_key: bot.response_cache.put(cache_key, response_text)
+            record_reply(conversation, prompt_chars, response_text)
+
+            await send_chunks(message, response_text)
+
+    except GeminiUnavailable as e: bot.metrics.replies.inc(1, "unavailable"); logging.error(f"Gemini indisponible: {e}"); await message.channel.send("Cerveau IA momentanément indisponible, réessaie dans une minute.")
+    except KeyError as e: bot.metrics.replies.inc(1, "error"); logging.exception(f"Clé persona non trouvée: {e}"); await message.channel.send("Erreur config personnalité.")
+    except Exception as e: bot.metrics.replies.inc(1, "error"); logging.exception("Erreur inattendue on_message:"); await message.channel.send("Erreur système Fent-Droid.")
+
+
+@asynccontextmanager
+async def llm_slot():
+    """Place dans le scheduler LLM, en mesurant l'attente."""
+    queued_at = time.monotonic()
+    async with bot.scheduler.llm():
+        bot.metrics.queue_wait.observe(time.monotonic() - queued_at, "llm")
+        yield
+
+
+def contents_chars(contents) -> int:
+    return sum(len(p) for turn in contents for p in turn["parts"] if isinstance(p, str))
+
+
+def record_reply(conversation, prompt_chars: int, response_text: str):
+    bot.metrics.response_chars.observe(len(response_text))
+    bot.metrics.replies.inc(1, "ok")
+    bot.metrics.sample_log("turn", key=conversation.key, persona=conversation.persona_id, outcome="ok",
+                           history_items=len(conversation.history), prompt_chars=prompt_chars, response_chars=len(response_text))
+
+
+async def send_chunks(message, response_text: str):
+    chunks = [response_text[i:i+2000] for i in range(0, len(response_text), 2000)]
+    for index, chunk in enumerate(chunks):
+        started = time.monotonic()
+        if index == 0: await message.reply(chunk, mention_author=False)
+        else: await message.channel.send(chunk)
+        bot.metrics.discord_send.observe(time.monotonic() - started)
+
 
-            bot.last_message_timestamp = datetime.datetime.now(timezone.utc)
-            logging.info(f"Interaction réussie. Timestamp mis à jour. Longueur historique: {len(bot.conversation_history)}")
+async def respond_streaming(message, conversation, user_turn: str, persona_model, contents):
+    """Variante streamée : affiche la réponse au fil des tokens, n'ajoute à l'historique qu'une fois le flux terminé.
 
-            chunks = [response_text[i:i+2000] for i in range(0, len(response_text), 2000)]
-            if chunks: await message.reply(chunks[0], mention_author=False)
-            for chunk in chunks[1:]: await message.channel.send(chunk)
+    Retourne le texte complet, ou None si Gemini n'a rien renvoyé."""
+    reply = StreamingReply(message, edit_interval=STREAM_EDIT_INTERVAL_SECONDS, on_send=bot.metrics.discord_send.observe)
+    started = time.monotonic(); first_chunk = True
+    async with aclosing(bot.gemini.stream(persona_model, contents)) as chunks:
+        async for chunk in chunks:
+            if first_chunk: bot.metrics.gemini_ttft.observe(time.monotonic() - started); first_chunk = False
+            if chunk.parts: await reply.feed(chunk.text)
+    bot.metrics.gemini_latency.observe(time.monotonic() - started, "stream")
+    response_text = await reply.finish()
+    if not response_text:
+        logging.warning(f"Réponse Gemini bloquée/vide ({len(user_turn)} caractères).")
+        bot.metrics.replies.inc(1, "blocked"); await message.channel.send("Je... bloque."); return None
 
-    except KeyError as e: logging.exception(f"Clé persona non trouvée: {e}"); await message.channel.send("Erreur config personnalité.")
-    except Exception as e: logging.exception("Erreur inattendue on_message:"); await message.channel.send("Erreur système Fent-Droid.")
+    commit_turn(conversation, user_turn, response_text)
+    record_reply(conversation, contents_chars(contents), response_text)
+    return response_text
 
 if __name__ == "__main__":
     if not DISCORD_TOKEN or not GEMINI_API_KEY: print("ERREUR CRITIQUE: .env")
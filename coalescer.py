@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import time
+
+
+class _Burst:
+    __slots__ = ("items", "first_at", "timer")
+
+    def __init__(self):
+        self.items = []
+        self.first_at = time.monotonic()
+        self.timer = None
+
+
+class BurstCoalescer:
+    """Regroupe les messages arrivant en rafale dans un salon pour n'en faire qu'un seul tour LLM.
+
+    Chaque message réarme une fenêtre d'attente adaptative : min_window pour un message isolé, allongée
+    (écart moyen entre messages rapprochés x gap_factor, au plus max_window) tant que le salon est en rafale ;
+    un écart plus long que la fenêtre courante met fin à la rafale. La rafale est envoyée à `handler(key, items)`
+    quand la fenêtre expire, quand max_batch messages sont réunis, ou max_window secondes après le premier.
+    """
+
+    def __init__(self, handler, min_window: float = 0.6, max_window: float = 3.0, max_batch: int = 10, gap_factor: float = 1.5):
+        self.handler = handler
+        self.min_window = min_window
+        self.max_window = max_window
+        self.max_batch = max_batch
+        self.gap_factor = gap_factor
+        self._bursts = {}
+        self._last_arrival = {}
+        self._gap_ema = {}
+        self._tasks = set()
+        self.batches = 0
+        self.messages = 0
+
+    def submit(self, key, item):
+        now = time.monotonic()
+        last = self._last_arrival.get(key)
+        if last is not None:
+            gap = now - last
+            if gap > self.window_for(key): self._gap_ema.pop(key, None)  # pas de rafale en cours
+            else: self._gap_ema[key] = 0.7 * self._gap_ema.get(key, gap) + 0.3 * gap
+        self._last_arrival[key] = now
+        self.messages += 1
+
+        burst = self._bursts.get(key)
+        if burst is None: burst = self._bursts[key] = _Burst()
+        burst.items.append(item)
+        if burst.timer is not None: burst.timer.cancel()
+
+        elapsed = now - burst.first_at
+        if len(burst.items) >= self.max_batch or elapsed >= self.max_window:
+            self._flush(key); return
+        window = min(self.window_for(key), self.max_window - elapsed)
+        burst.timer = asyncio.get_running_loop().call_later(window, self._flush, key)
+
+    @property
+    def pending(self) -> int:
+        """Nombre de messages en attente dans des rafales pas encore envoyées."""
+        return sum(len(burst.items) for burst in self._bursts.values())
+
+    def window_for(self, key) -> float:
+        gap = self._gap_ema.get(key)
+        if gap is None: return self.min_window
+        return max(self.min_window, min(self.max_window, gap * self.gap_factor))
+
+    def _flush(self, key):
+        burst = self._bursts.pop(key, None)
+        if burst is None: return
+        if burst.timer is not None: burst.timer.cancel()
+        self.batches += 1
+        if len(burst.items) > 1: logging.info(f"Rafale de {len(burst.items)} messages regroupée pour {key}.")
+        task = asyncio.get_running_loop().create_task(self._run(key, burst.items))
+        self._tasks.add(task); task.add_done_callback(self._tasks.discard)  # la boucle ne garde qu'une référence faible
+
+    async def _run(self, key, items):
+        try: await self.handler(key, items)
+        except Exception: logging.exception(f"Erreur traitement rafale {key}:")
@@ -1,9 +1,98 @@
+import hashlib
+import json
+import os
 import discord
+from discord import app_commands
 from discord.ext import commands
-import bot as bot_module_for_functions
-import datetime
-from datetime import timezone
 import logging
+from persona_repository import write_atomic
+from state_backend import aggregate_status
+
+PERSONAS_PAGE_SIZE = 10
+
+
+class PersonaPages(discord.ui.View):
+    """Liste paginée des personnalités : seule la page affichée est construite, à la demande."""
+
+    def __init__(self, bot_instance: commands.Bot, author_id: int, active_persona_id: str, page_size: int = PERSONAS_PAGE_SIZE):
+        super().__init__(timeout=180)
+        self.bot_instance = bot_instance
+        self.author_id = author_id
+        self.active_persona_id = active_persona_id
+        self.page_size = page_size
+        self.page = 0
+        self._update_buttons()
+
+    @property
+    def page_count(self) -> int:
+        return max(1, -(-len(self.bot_instance.persona_index) // self.page_size))
+
+    def render(self) -> discord.Embed:
+        self.page = min(self.page, self.page_count - 1)
+        embed = discord.Embed(
+            title="Personnalités de Zynx GPT",
+            description=f"Personnalité active : **{self.active_persona_id}**",
+            color=0x3498db
+        )
+        start = self.page * self.page_size
+        persona_ids = self.bot_instance.persona_index.ids()[start:start + self.page_size]
+        if not persona_ids:
+            embed.add_field(name="Aucune personnalité trouvée", value="L'attribut personas du bot semble vide.", inline=False)
+        for persona_id in persona_ids:
+            persona_data = self.bot_instance.personas.get(persona_id, {})
+            embed.add_field(
+                name=f"{persona_data.get('name', persona_id)} ({persona_id})"[:256],
+                value=(persona_data.get('description') or 'N/A')[:300],
+                inline=False
+            )
+        embed.set_footer(text=f"Page {self.page + 1}/{self.page_count} - {len(self.bot_instance.persona_index)} personnalités")
+        return embed
+
+    def _update_buttons(self):
+        self.previous_page.disabled = self.page <= 0
+        self.next_page.disabled = self.page >= self.page_count - 1
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id == self.author_id: return True
+        await interaction.response.send_message("Lance ta propre commande /personas pour naviguer.", ephemeral=True)
+        return False
+
+    async def _show(self, interaction: discord.Interaction):
+        embed = self.render(); self._update_buttons()
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = max(0, self.page - 1); await self._show(interaction)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page += 1; await self._show(interaction)
+
+
+def command_tree_hash(bot_instance: commands.Bot) -> str:
+    """Empreinte des signatures des commandes slash (et de l'application) telles qu'envoyées à Discord."""
+    payload = sorted((command.to_dict(bot_instance.tree) for command in bot_instance.tree.get_commands()), key=lambda c: c["name"])
+    data = json.dumps({"application_id": bot_instance.application_id, "commands": payload}, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+async def sync_if_changed(bot_instance: commands.Bot, hash_file: str) -> bool:
+    """Synchronise l'arbre de commandes seulement si les signatures ont changé depuis la dernière sync réussie.
+
+    tree.sync() est fortement limité par Discord : inutile de le refaire à chaque démarrage ou reconnexion."""
+    digest = command_tree_hash(bot_instance)
+    try:
+        with open(hash_file, "r", encoding="utf-8") as f: previous = f.read().strip()
+    except FileNotFoundError: previous = None
+    if previous == digest:
+        logging.info("Commandes inchangées depuis la dernière sync, sync ignorée."); return False
+    synced = await bot_instance.tree.sync()
+    logging.info(f"Commandes sync ({len(synced)})")
+    try: write_atomic(hash_file, digest)
+    except OSError as e: logging.warning(f"Impossible d'écrire {os.path.basename(hash_file)}: {e}")
+    return True
+
 
 def setup(bot_instance: commands.Bot):
     """Configure les commandes slash pour le bot."""
@@ -23,7 +112,7 @@ def setup(bot_instance: commands.Bot):
                         inline=False)
         embed.add_field(name="/persona_create", value="Crée une nouvelle personnalité.",
                         inline=False)
-        embed.add_field(name="/persona_edit", value="Modifie le nom, la description ou le prompt d'une personnalité.",
+        embed.add_field(name="/persona_edit", value="Modifie le nom, la description, le prompt ou le cache des réponses d'une personnalité.",
                         inline=False)
         embed.add_field(name="/persona_delete", value="Supprime une personnalité existante.",
                         inline=False)
@@ -34,28 +123,24 @@ def setup(bot_instance: commands.Bot):
 
     @bot_instance.tree.command(name="ping", description="Vérifiez la latence du bot")
     async def ping_command(interaction: discord.Interaction): # ... code ...
-        latency = round(bot_instance.latency * 1000); await interaction.response.send_message(f"Pong! Latence: {latency}ms.")
+        latency = round(bot_instance.latency * 1000); stats = bot_instance.scheduler.stats()
+        cache_stats = bot_instance.response_cache.stats()
+        cluster = aggregate_status(await bot_instance.state.statuses())
+        await interaction.response.send_message(
+            f"Pong! Latence: {latency}ms.\n"
+            f"File LLM: {stats['waiting']} en attente, {stats['in_flight']}/{stats['max_concurrent']} en cours, "
+            f"attente p95 {stats['llm_wait_p95'] * 1000:.0f}ms, {stats['shed']} rejetée(s).\n"
+            f"Cache réponses: {cache_stats['hits']} hit(s), {cache_stats['misses']} miss, {cache_stats['entries']} entrée(s).\n"
+            f"Cluster: {cluster['workers']} processus, {cluster['shards_ready']}/{cluster['shard_count'] or cluster['shards']} shard(s) prêt(s), "
+            f"{cluster['guilds']} serveur(s), {cluster['llm_in_flight']} requête(s) LLM en cours.")
 
     @bot_instance.tree.command(name="personas", description="Affiche les personnalités disponibles")
     async def personas_command(interaction: discord.Interaction):
         logging.info(f"Commande /personas reçue de {interaction.user}")
         try:
-            embed = discord.Embed(
-                title="Personnalités de Zynx GPT",
-                description=f"Personnalité active : **{bot_instance.active_persona_id}**",
-                color=0x3498db
-            )
-            personas_dict = getattr(bot_instance, 'personas', {})
-            if not personas_dict:
-                 embed.add_field(name="Aucune personnalité trouvée", value="L'attribut personas du bot semble vide.", inline=False)
-            else:
-                for persona_id, persona_data in personas_dict.items():
-                    embed.add_field(
-                        name=f"{persona_data.get('name', persona_id)} ({persona_id})",
-                        value=persona_data.get('description', 'N/A'),
-                        inline=False
-                    )
-            await interaction.response.send_message(embed=embed)
+            conversation = await bot_instance.conversations.load(bot_instance.conversations.key_for_interaction(interaction))
+            view = PersonaPages(bot_instance, interaction.user.id, conversation.persona_id)
+            await interaction.response.send_message(embed=view.render(), view=view)
         except Exception as e:
             logging.exception("Erreur dans /personas:")
             try: await interaction.response.send_message("Impossible d'afficher les personnalités.", ephemeral=True)
@@ -68,14 +153,12 @@ def setup(bot_instance: commands.Bot):
         await interaction.response.defer(ephemeral=False)
         try:
             if persona_id not in bot_instance.personas:
-                logging.warning(f"/persona_set: ID '{persona_id}' non trouvé dans bot.personas {list(bot_instance.personas.keys())}")
+                logging.warning(f"/persona_set: ID '{persona_id}' non trouvé dans bot.personas ({len(bot_instance.personas)} personas)")
                 await interaction.followup.send(f"Erreur : ID '{persona_id}' introuvable.", ephemeral=True); return
-            bot_instance.active_persona_id = persona_id
+            conversation = await bot_instance.conversations.load(bot_instance.conversations.key_for_interaction(interaction))
+            conversation.reset(persona_id, touch=True)
             persona_name = bot_instance.personas[persona_id].get("name", persona_id)
-            logging.info(f"/persona_set: bot_instance.active_persona_id -> {bot_instance.active_persona_id}")
-            bot_instance.conversation_history = []
-            bot_instance.last_message_timestamp = datetime.datetime.now(timezone.utc)
-            logging.info("/persona_set: Historique et timestamp sur bot_instance réinitialisés.")
+            logging.info(f"/persona_set: {conversation.key} -> persona '{persona_id}'. Historique et timestamp réinitialisés.")
 
             await interaction.followup.send(f"OK. Personnalité -> **{persona_name}** ({persona_id}).\n*Mémoire conversationnelle réinitialisée.*")
         except Exception as e:
@@ -99,10 +182,11 @@ def setup(bot_instance: commands.Bot):
             prompt_msg = "Prompt fourni." if prompt and prompt.strip() else "Prompt défaut utilisé."
 
             bot_instance.personas[persona_id] = {"name": name, "description": description, "prompt": final_prompt}
-            logging.info(f"/persona_create: Persona '{persona_id}' ajoutée à bot.personas. Clés: {list(bot_instance.personas.keys())}")
+            bot_instance.persona_index.update(persona_id, bot_instance.personas[persona_id])
+            logging.info(f"/persona_create: Persona '{persona_id}' ajoutée à bot.personas ({len(bot_instance.personas)} personas).")
 
             try:
-                bot_module_for_functions.save_personas(bot_instance)
+                bot_instance.persona_repo.save()
             except Exception as e:
                 logging.error(f"/persona_create: Échec save_personas pour '{persona_id}': {e}")
                 await interaction.followup.send("Erreur sauvegarde nouvelle personnalité.", ephemeral=True); return
@@ -116,7 +200,7 @@ def setup(bot_instance: commands.Bot):
     @bot_instance.tree.command(name="persona_edit", description="Modifie nom, descricption ou prompt d'une personnalité")
     async def persona_edit_command(
             interaction: discord.Interaction,
-            persona_id: str, name: str = None, description: str = None, prompt: str = None
+            persona_id: str, name: str = None, description: str = None, prompt: str = None, cache: bool = None
     ):
         logging.info(f"Commande /persona_edit reçue de {interaction.user} pour ID: {persona_id}")
         await interaction.response.defer(ephemeral=False)
@@ -130,21 +214,25 @@ def setup(bot_instance: commands.Bot):
             if name is not None: persona["name"] = name; changes.append("nom")
             if description is not None: persona["description"] = description; changes.append("description")
             if prompt is not None: persona["prompt"] = prompt.strip(); changes.append("prompt"); prompt_changed = True
+            if cache is not None: persona["cache_responses"] = cache; changes.append("cache " + ("activé" if cache else "désactivé"))
 
             if changes:
+                bot_instance.persona_index.update(persona_id, persona)
                 logging.info(f"/persona_edit: Modifications pour '{persona_id}': {', '.join(changes)}. Sauvegarde...")
                 try:
-                    bot_module_for_functions.save_personas(bot_instance)
+                    bot_instance.persona_repo.save()
                 except Exception as e:
                      logging.error(f"/persona_edit: Échec sauvegarde '{persona_id}': {e}")
                      await interaction.followup.send("Erreur sauvegarde après édition.", ephemeral=True); return
 
 
                 reset_msg = ""
-                if prompt_changed and persona_id == bot_instance.active_persona_id:
-                     bot_instance.conversation_history = []; bot_instance.last_message_timestamp = datetime.datetime.now(timezone.utc)
-                     reset_msg = "\n*Mémoire réinitialisée car le prompt actif a changé.*"
-                     logging.info(f"/persona_edit: Historique réinitialisé car prompt actif ('{persona_id}') modifié.")
+                if prompt_changed:
+                     bot_instance.models.invalidate(persona_id)
+                     reset_count = bot_instance.conversations.reset_persona_everywhere(persona_id)
+                     if reset_count:
+                         reset_msg = "\n*Mémoire réinitialisée car le prompt actif a changé.*"
+                         logging.info(f"/persona_edit: {reset_count} historique(s) réinitialisé(s) car prompt actif ('{persona_id}') modifié.")
 
                 await interaction.followup.send(f"OK. '{persona_id}' modifiée: {', '.join(changes)}.{reset_msg}")
             else:
@@ -175,25 +263,25 @@ def setup(bot_instance: commands.Bot):
             deleted_persona_name = bot_instance.personas[persona_id].get('name', persona_id)
 
             del bot_instance.personas[persona_id]
+            bot_instance.persona_index.remove(persona_id)
+            bot_instance.models.invalidate(persona_id)
             logging.info(f"/persona_delete: Persona '{persona_id}' supprimée de bot.personas.")
 
             try:
-                bot_module_for_functions.save_personas(bot_instance)
+                bot_instance.persona_repo.save()
             except Exception as e:
                 logging.error(f"/persona_delete: Échec de save_personas après suppression de '{persona_id}': {e}")
                 await interaction.followup.send(
                     "ERREUR CRITIQUE : La personnalité a été supprimée en mémoire mais la sauvegarde a échoué. "
                     "L'état est incohérent. Contactez un administrateur.",
                     ephemeral=True
-                ).
+                )
                 return
 
             reset_msg = ""
-            if bot_instance.active_persona_id == persona_id:
-                logging.info(f"/persona_delete: La personnalité active '{persona_id}' a été supprimée. Retour à 'default'.")
-                bot_instance.active_persona_id = "default"
-                bot_instance.conversation_history = []
-                bot_instance.last_message_timestamp = datetime.datetime.now(timezone.utc)
+            reset_count = bot_instance.conversations.reset_persona_everywhere(persona_id, "default")
+            if reset_count:
+                logging.info(f"/persona_delete: La personnalité active '{persona_id}' a été supprimée ({reset_count} conversation(s)). Retour à 'default'.")
                 reset_msg = f"\nComme c'était la personnalité active, retour à 'default' et réinitialisation de la mémoire."
 
             await interaction.followup.send(
@@ -207,3 +295,13 @@ def setup(bot_instance: commands.Bot):
             except discord.errors.NotFound:
                 logging.error("Impossible d'envoyer l'erreur followup pour /persona_delete.")
 
+    async def persona_id_autocomplete(interaction: discord.Interaction, current: str):
+        choices = []
+        for persona_id in bot_instance.persona_index.search(current, limit=25):
+            persona_name = bot_instance.personas.get(persona_id, {}).get("name", persona_id)
+            choices.append(app_commands.Choice(name=f"{persona_name} ({persona_id})"[:100], value=persona_id[:100]))
+        return choices
+
+    persona_set_command.autocomplete("persona_id")(persona_id_autocomplete)
+    persona_edit_command.autocomplete("persona_id")(persona_id_autocomplete)
+    persona_delete_command.autocomplete("persona_id")(persona_id_autocomplete)
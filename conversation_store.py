@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import datetime
+from datetime import timezone
+from collections import OrderedDict, deque
+
+
+class Conversation:
+    """État d'une conversation (un salon ou un thread) : historique borné, persona et timer d'inactivité.
+
+    Les tours qui sortent de la fenêtre sont déplacés dans `evicted` en attendant d'être résumés dans `summary`.
+    `epoch` change à chaque reset, pour qu'un résumé calculé en arrière-plan ne ressuscite pas un ancien contexte.
+    `folded` compte les tours de l'epoch déjà intégrés au résumé (le journal ne les recharge pas).
+    """
+
+    __slots__ = ("key", "history", "max_items", "persona_id", "timeout", "last_message_timestamp",
+                 "summary", "evicted", "epoch", "folded", "listener")
+
+    def __init__(self, key, max_items: int, persona_id: str, timeout: datetime.timedelta):
+        self.key = key
+        self.history = deque()
+        self.max_items = max_items
+        self.persona_id = persona_id
+        self.timeout = timeout
+        self.last_message_timestamp = None
+        self.summary = ""
+        self.evicted = []
+        self.epoch = 0
+        self.folded = 0
+        self.listener = None
+
+    def is_expired(self, now: datetime.datetime = None) -> bool:
+        if self.last_message_timestamp is None: return False
+        now = now or datetime.datetime.now(timezone.utc)
+        return now - self.last_message_timestamp > self.timeout
+
+    def reset(self, persona_id: str = None, touch: bool = False):
+        """Vide l'historique, change éventuellement de persona et met à jour le timestamp si demandé."""
+        self.history.clear()
+        self.summary = ""; self.evicted = []; self.epoch += 1; self.folded = 0
+        if persona_id is not None: self.persona_id = persona_id
+        self.last_message_timestamp = datetime.datetime.now(timezone.utc) if touch else None
+        if self.listener: self.listener.conversation_changed(self)
+
+    def append_turn(self, user_message: str, response_text: str):
+        self.history.append({"role": "user", "parts": [user_message]})
+        self.history.append({"role": "model", "parts": [response_text]})
+        while len(self.history) > self.max_items: self.evict_oldest()
+        self.last_message_timestamp = datetime.datetime.now(timezone.utc)
+        if self.listener: self.listener.turn_appended(self, user_message, response_text)
+
+    def update_summary(self, summary: str, folded_turns: int):
+        """Remplace le résumé glissant après y avoir intégré les `folded_turns` premiers tours évincés."""
+        self.summary = summary
+        del self.evicted[:folded_turns]
+        self.folded += folded_turns
+        if self.listener: self.listener.conversation_changed(self)
+
+    def drop_evicted(self, count: int):
+        """Abandonne les `count` plus anciens tours évincés sans les résumer (arriéré trop long)."""
+        del self.evicted[:count]
+        self.folded += count
+        if self.listener: self.listener.conversation_changed(self)
+
+    def evict_oldest(self):
+        """Sort le plus ancien item de la fenêtre ; il sera intégré au résumé glissant."""
+        self.evicted.append(self.history.popleft())
+
+
+class ConversationStore:
+    """Conversations indexées par (guild, salon, thread), avec éviction LRU des conversations inactives."""
+
+    def __init__(self, max_items: int = 20, timeout_minutes: float = 2, max_conversations: int = 1000,
+                 default_persona_id: str = "default", per_thread: bool = True):
+        self.max_items = max_items
+        self.timeout = datetime.timedelta(minutes=timeout_minutes)
+        self.max_conversations = max_conversations
+        self.default_persona_id = default_persona_id
+        self.per_thread = per_thread
+        self.log = None
+        self._conversations = OrderedDict()
+        self._loading = {}
+
+    def __len__(self): return len(self._conversations)
+
+    def __contains__(self, key): return key in self._conversations
+
+    def key_for(self, guild_id, channel):
+        """Calcule la clé d'une conversation. Un thread a sa propre conversation si per_thread est actif."""
+        parent_id = getattr(channel, "parent_id", None)
+        if parent_id is not None:
+            return (guild_id, parent_id, channel.id if self.per_thread else None)
+        return (guild_id, channel.id, None)
+
+    def key_for_message(self, message):
+        return self.key_for(message.guild.id if message.guild else None, message.channel)
+
+    def key_for_interaction(self, interaction):
+        return self.key_for(interaction.guild_id, interaction.channel)
+
+    def get(self, key) -> Conversation:
+        """Retourne la conversation (créée si besoin) et la marque comme la plus récemment utilisée."""
+        conv = self._conversations.get(key)
+        if conv is not None:
+            self._conversations.move_to_end(key)
+            return conv
+        conv = Conversation(key, self.max_items, self.default_persona_id, self.timeout)
+        conv.listener = self.log
+        self._conversations[key] = conv
+        self._evict()
+        return conv
+
+    async def load(self, key) -> Conversation:
+        """Comme get(), mais recharge depuis le journal persistant la première fois que la conversation est touchée."""
+        if self.log is None or key in self._conversations: return self.get(key)
+        pending = self._loading.get(key)
+        if pending is None:
+            pending = self._loading[key] = asyncio.ensure_future(self.log.load(key))
+            pending.add_done_callback(lambda _: self._loading.pop(key, None))
+        state = await pending
+        if key in self._conversations: return self.get(key)
+        conv = self.get(key)
+        if state is not None and state.get("expired"):
+            conv.epoch = state["epoch"] + 1  # ne pas réécrire dans l'epoch (pas encore compactée) de l'ancienne conversation
+        elif state is not None:
+            conv.persona_id = state["persona_id"]; conv.summary = state["summary"]; conv.epoch = state["epoch"]
+            conv.folded = state["folded"]
+            conv.last_message_timestamp = state["last_message_timestamp"]
+            conv.history.extend(state["turns"])
+            logging.info(f"Conversation {key} rechargée depuis le journal ({len(conv.history)} tour(s)).")
+        return conv
+
+    def discard(self, key):
+        self._conversations.pop(key, None)
+
+    def conversations(self):
+        return list(self._conversations.values())
+
+    def reset_persona_everywhere(self, persona_id: str, new_persona_id: str = None):
+        """Réinitialise toutes les conversations utilisant persona_id. Retourne le nombre de conversations touchées."""
+        count = 0
+        for conv in self._conversations.values():
+            if conv.persona_id == persona_id:
+                conv.reset(new_persona_id, touch=True); count += 1
+        return count
+
+    def _evict(self):
+        while len(self._conversations) > self.max_conversations:
+            key, _ = self._conversations.popitem(last=False)
+            logging.info(f"Conversation {key} évincée (LRU, max={self.max_conversations}).")
@@ -0,0 +1,250 @@
+import asyncio
+import contextlib
+import logging
+import random
+import time
+from collections import deque
+
+from google.api_core import exceptions as google_exceptions
+
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+
+
+class GeminiUnavailable(Exception):
+    """Levée quand aucun modèle de la chaîne n'a pu répondre (circuits ouverts ou essais épuisés)."""
+
+
+def retry_after_seconds(error):
+    """Délai demandé par le serveur (en-tête Retry-After ou RetryInfo), ou None."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if value:
+        try: return float(value)
+        except ValueError: pass
+    for detail in getattr(error, "details", None) or ():
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None: return delay.seconds + delay.nanos / 1e9
+    return None
+
+
+class ThreadedModel:
+    """Fournit `generate_content_async` / `count_tokens_async` au-dessus des méthodes synchrones d'un modèle,
+    exécutées dans un thread. Nécessaire avec transport="rest" (GEMINI_API_ENDPOINT), qui n'a pas de client asynchrone.
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    async def generate_content_async(self, contents, stream=False):
+        response = await asyncio.to_thread(self.model.generate_content, contents, stream=stream)
+        return _ThreadedChunks(response) if stream else response
+
+    async def count_tokens_async(self, contents):
+        return await asyncio.to_thread(self.model.count_tokens, contents)
+
+
+class _ThreadedChunks:
+    """Itérateur asynchrone sur une réponse streamée synchrone ; chaque chunk est lu dans un thread."""
+
+    def __init__(self, response):
+        self._chunks = iter(response)
+
+    def __aiter__(self): return self
+
+    async def __anext__(self):
+        chunk = await asyncio.to_thread(next, self._chunks, None)
+        if chunk is None: raise StopAsyncIteration
+        return chunk
+
+
+class CircuitBreaker:
+    """Coupe les appels vers un modèle après `failure_threshold` échecs consécutifs.
+
+    Après `reset_timeout` secondes, un seul appel d'essai passe (semi-ouvert) : s'il réussit le circuit se referme.
+    Un essai qui n'aboutit ni à un succès ni à une erreur de disponibilité (annulé, requête invalide...) doit
+    rendre sa place avec `release()`, sinon le modèle resterait bloqué en semi-ouvert.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None: return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout: return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed": return True
+        if state == "half_open" and not self._probing:
+            self._probing = True; return True
+        return False
+
+    def record_success(self):
+        self.failures = 0; self.opened_at = None; self._probing = False
+
+    def release(self):
+        """Libère l'essai semi-ouvert en cours sans rien conclure sur l'état du modèle."""
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1; self._probing = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class ModelHealth:
+    """Latences et erreurs récentes d'un modèle, sur une fenêtre glissante en temps."""
+
+    def __init__(self, window_seconds: float = 60, max_samples: int = 200):
+        self.window = window_seconds
+        self._samples = deque(maxlen=max_samples)
+
+    def record(self, latency: float, ok: bool):
+        self._samples.append((time.monotonic(), latency, ok))
+
+    def _recent(self):
+        cutoff = time.monotonic() - self.window
+        return [s for s in self._samples if s[0] >= cutoff]
+
+    def snapshot(self) -> dict:
+        recent = self._recent()
+        latencies = sorted(s[1] for s in recent if s[2])
+        errors = sum(1 for s in recent if not s[2])
+        return {
+            "samples": len(recent),
+            "p95": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else 0.0,
+            "error_rate": errors / len(recent) if recent else 0.0,
+        }
+
+
+class GeminiClient:
+    """Appels Gemini avec délai par requête, essais avec backoff exponentiel (jitter, Retry-After),
+    disjoncteur par modèle et repli sur les modèles suivants de `model_names`.
+
+    Un modèle est évité tant que son p95 ou son taux d'erreur récents dépassent les seuils ;
+    `get_model(model_name)` fournit l'instance à appeler (typiquement le ModelPool de la persona).
+    `slot()` (contexte asynchrone, ex. Scheduler.llm) est tenu pendant chaque essai, flux compris, mais rendu
+    pendant le backoff : une panne amont n'immobilise pas les places des autres conversations.
+    """
+
+    def __init__(self, model_names, deadline: float = 60, max_attempts: int = 3, base_delay: float = 0.5,
+                 max_delay: float = 10, failure_threshold: int = 5, reset_timeout: float = 30,
+                 p95_threshold: float = 20, error_rate_threshold: float = 0.5, min_samples: int = 5, slot=None):
+        self.model_names = list(model_names)
+        self.slot = slot or contextlib.nullcontext
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.p95_threshold = p95_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_samples = min_samples
+        self.breakers = {name: CircuitBreaker(failure_threshold, reset_timeout) for name in self.model_names}
+        self.health = {name: ModelHealth() for name in self.model_names}
+
+    async def generate(self, get_model, contents):
+        """Réponse complète (non streamée)."""
+        last_error = None
+        for attempt in range(self.max_attempts):
+            async with self.slot():
+                model_name = self._pick_model()
+                start = time.monotonic()
+                try:
+                    response = await asyncio.wait_for(get_model(model_name).generate_content_async(contents), timeout=self.deadline)
+                except RETRYABLE_ERRORS as e:
+                    last_error = e
+                    self._record(model_name, start, ok=False)
+                except BaseException:
+                    self.breakers[model_name].release(); raise
+                else:
+                    self._record(model_name, start, ok=True)
+                    return response
+            await self._backoff(attempt, last_error, model_name)
+        raise GeminiUnavailable(f"Échec après {self.max_attempts} essai(s): {last_error!r}") from last_error
+
+    async def stream(self, get_model, contents):
+        """Générateur de chunks. Les essais et le repli ne s'appliquent qu'avant le premier chunk reçu."""
+        last_error = None
+        for attempt in range(self.max_attempts):
+            async with self.slot():
+                model_name = self._pick_model()
+                start = time.monotonic()
+                try:
+                    response = await asyncio.wait_for(
+                        get_model(model_name).generate_content_async(contents, stream=True), timeout=self.deadline)
+                    chunks = response.__aiter__()
+                    first = await asyncio.wait_for(chunks.__anext__(), timeout=self.deadline - (time.monotonic() - start))
+                except StopAsyncIteration:
+                    self._record(model_name, start, ok=True); return
+                except RETRYABLE_ERRORS as e:
+                    last_error = e
+                    self._record(model_name, start, ok=False)
+                except BaseException:
+                    self.breakers[model_name].release(); raise
+                else:
+                    ok = None  # reste None si le consommateur abandonne le flux ou si l'erreur ne concerne pas le modèle
+                    try:
+                        yield first
+                        while True:
+                            try: chunk = await asyncio.wait_for(chunks.__anext__(), timeout=self.deadline)
+                            except StopAsyncIteration: break
+                            yield chunk
+                        ok = True
+                    except RETRYABLE_ERRORS:
+                        ok = False; raise
+                    finally:
+                        if ok is None: self.breakers[model_name].release()
+                        else: self._record(model_name, start, ok)
+                    return
+            await self._backoff(attempt, last_error, model_name)
+        raise GeminiUnavailable(f"Échec après {self.max_attempts} essai(s): {last_error!r}") from last_error
+
+    def status(self) -> dict:
+        return {name: {"circuit": self.breakers[name].state, **self.health[name].snapshot()} for name in self.model_names}
+
+    def _pick_model(self) -> str:
+        for name in self.model_names:
+            if self._degraded(name): continue
+            if self.breakers[name].allow(): return name
+        for name in self.model_names:
+            if self.breakers[name].allow(): return name
+        raise GeminiUnavailable("Tous les circuits Gemini sont ouverts.")
+
+    def _degraded(self, name: str) -> bool:
+        if name == self.model_names[-1]: return False
+        snapshot = self.health[name].snapshot()
+        if snapshot["samples"] < self.min_samples: return False
+        return snapshot["p95"] > self.p95_threshold or snapshot["error_rate"] > self.error_rate_threshold
+
+    def _record(self, model_name: str, start: float, ok: bool):
+        self.health[model_name].record(time.monotonic() - start, ok)
+        if ok: self.breakers[model_name].record_success()
+        else: self.breakers[model_name].record_failure()
+
+    async def _backoff(self, attempt: int, error, model_name: str):
+        if attempt >= self.max_attempts - 1: return
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        requested = retry_after_seconds(error)
+        if requested is not None: delay = max(delay, min(requested, self.max_delay))
+        logging.warning(f"Erreur Gemini sur {model_name} ({type(error).__name__}), nouvel essai dans {delay:.2f}s.")
+        await asyncio.sleep(delay)
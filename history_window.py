@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import random
+
+
+class TokenEstimator:
+    """Estimation locale et rapide du nombre de tokens (caractères / ratio).
+
+    Le ratio peut être recalibré sur `count_tokens` de Gemini avec un échantillon des tours envoyés.
+    `extra_tokens(text)`, si fourni, ajoute ce que coûte le contenu référencé par le texte (pièces jointes développées).
+    """
+
+    def __init__(self, chars_per_token: float = 4.0, calibration_rate: float = 0.02, extra_tokens=None):
+        self.chars_per_token = chars_per_token
+        self.calibration_rate = calibration_rate
+        self.extra_tokens = extra_tokens
+        self._calibrating = False
+
+    def estimate(self, text: str) -> int:
+        tokens = int(len(text) / self.chars_per_token) + 1
+        return tokens + self.extra_tokens(text) if self.extra_tokens else tokens
+
+    def estimate_turn(self, turn: dict) -> int:
+        return sum(self.estimate(part) for part in turn.get("parts", []) if isinstance(part, str)) + 4
+
+    def maybe_calibrate(self, model, text: str):
+        """Lance (parfois) une calibration en arrière-plan, hors du chemin de réponse."""
+        if self._calibrating or not text or random.random() >= self.calibration_rate: return
+        self._calibrating = True
+        asyncio.get_running_loop().create_task(self._calibrate(model, text))
+
+    async def _calibrate(self, model, text: str):
+        try:
+            result = await model.count_tokens_async(text)
+            if result.total_tokens:
+                measured = len(text) / result.total_tokens
+                self.chars_per_token = 0.8 * self.chars_per_token + 0.2 * measured
+                logging.info(f"Estimation tokens recalibrée: {self.chars_per_token:.2f} caractères/token.")
+        except Exception as e:
+            logging.warning(f"Calibration count_tokens échouée: {e}")
+        finally:
+            self._calibrating = False
+
+
+class HistoryWindow:
+    """Garde l'historique d'une conversation sous un budget de tokens, avec un résumé glissant.
+
+    Les tours qui dépassent le budget sont retirés de la fenêtre puis résumés en arrière-plan ;
+    le résumé est renvoyé à Gemini en tête des `contents`.
+    Chaque appel de résumé intègre au plus `summary_batch_tokens` de tours évincés ; si l'arriéré dépasse
+    `max_evicted_tokens` (résumés en échec, Gemini indisponible...), ses plus anciens tours sont abandonnés.
+    """
+
+    SUMMARY_PROMPT = (
+        "Tu résumes une conversation Discord pour un assistant qui va la poursuivre. "
+        "Mets à jour le résumé existant avec les nouveaux échanges. Garde les faits, noms, demandes "
+        "en cours et le ton ; reste sous {max_words} mots. Réponds uniquement avec le résumé.\n\n"
+        "--- RÉSUMÉ EXISTANT ---\n{summary}\n\n--- NOUVEAUX ÉCHANGES ---\n{turns}"
+    )
+
+    def __init__(self, summary_model, token_budget: int = 4000, summary_max_words: int = 200,
+                 estimator: TokenEstimator = None, scheduler=None, summary_batch_tokens: int = 4000,
+                 max_evicted_tokens: int = 16000):
+        self.summary_model = summary_model
+        self.token_budget = token_budget
+        self.summary_max_words = summary_max_words
+        self.summary_batch_tokens = summary_batch_tokens
+        self.max_evicted_tokens = max_evicted_tokens
+        self.estimator = estimator or TokenEstimator()
+        self.scheduler = scheduler
+        self._tasks = {}
+
+    def history_tokens(self, conversation) -> int:
+        return sum(self.estimator.estimate_turn(turn) for turn in conversation.history)
+
+    def fit(self, conversation, reserve_tokens: int = 0):
+        """Retire les plus anciens tours jusqu'à tenir dans le budget (en gardant au moins le dernier échange)."""
+        budget = self.token_budget - reserve_tokens - self.estimator.estimate(conversation.summary)
+        total = self.history_tokens(conversation)
+        while total > budget and len(conversation.history) > 2:
+            total -= self.estimator.estimate_turn(conversation.history[0])
+            conversation.evict_oldest()
+            while conversation.history and conversation.history[0].get("role") != "user":
+                total -= self.estimator.estimate_turn(conversation.history[0])
+                conversation.evict_oldest()
+        return total
+
+    def contents_prefix(self, conversation):
+        """Tours à placer avant l'historique pour transmettre le résumé glissant."""
+        if not conversation.summary: return []
+        return [{"role": "user", "parts": [f"Résumé de la conversation jusqu'ici : {conversation.summary}"]},
+                {"role": "model", "parts": ["Compris, je garde ce contexte en tête."]}]
+
+    def schedule_summary(self, conversation):
+        """Résume en arrière-plan les tours sortis de la fenêtre, si ce n'est pas déjà en cours."""
+        if not conversation.evicted: return
+        task = self._tasks.get(conversation.key)
+        if task is not None and not task.done(): return
+        self._drop_backlog(conversation)  # pas de résumé en cours : `evicted` ne bouge pas sous nos pieds
+        task = asyncio.get_running_loop().create_task(self._summarize(conversation))
+        self._tasks[conversation.key] = task
+        task.add_done_callback(lambda t, key=conversation.key: self._tasks.pop(key, None) if self._tasks.get(key) is t else None)
+
+    async def _summarize(self, conversation):
+        epoch = conversation.epoch
+        turns, tokens = [], 0
+        for turn in conversation.evicted:
+            tokens += self._summary_tokens(turn)
+            if turns and tokens > self.summary_batch_tokens: break
+            turns.append(turn)
+        text = "\n".join(f"{turn['role']}: {' '.join(p for p in turn['parts'] if isinstance(p, str))}" for turn in turns)
+        prompt = self.SUMMARY_PROMPT.format(max_words=self.summary_max_words, summary=conversation.summary or "(aucun)", turns=text)
+        try:
+            if self.scheduler is not None:
+                async with self.scheduler.llm(): response = await self.summary_model.generate_content_async(prompt)
+            else:
+                response = await self.summary_model.generate_content_async(prompt)
+            summary = response.text.strip() if response.parts else ""
+        except Exception as e:
+            logging.warning(f"Résumé glissant échoué pour {conversation.key}: {e}")
+            return
+        if conversation.epoch != epoch or not summary: return
+        conversation.update_summary(summary, len(turns))
+        logging.info(f"Résumé glissant mis à jour pour {conversation.key} ({len(turns)} tour(s) intégrés, {len(summary)} caractères).")
+
+    def _summary_tokens(self, turn: dict) -> int:
+        """Coût d'un tour évincé dans le prompt de résumé (texte seul, les pièces jointes n'y sont pas développées)."""
+        return int(sum(len(p) for p in turn.get("parts", []) if isinstance(p, str)) / self.estimator.chars_per_token) + 4
+
+    def _drop_backlog(self, conversation):
+        total = sum(self._summary_tokens(turn) for turn in conversation.evicted)
+        dropped = 0
+        while total > self.max_evicted_tokens and dropped < len(conversation.evicted):
+            total -= self._summary_tokens(conversation.evicted[dropped]); dropped += 1
+        if not dropped: return
+        conversation.drop_evicted(dropped)
+        logging.warning(f"Arriéré de résumé trop long pour {conversation.key}: {dropped} tour(s) évincé(s) abandonné(s).")
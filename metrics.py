@@ -0,0 +1,180 @@
+import asyncio
+import bisect
+import json
+import logging
+import random
+import time
+
+from aiohttp import web
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (100, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(names, values) -> str:
+    if not names: return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name; self.help = help_text; self.label_names = tuple(labels)
+        self._values = {}
+
+    def inc(self, amount: float = 1, *label_values):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def set(self, value: float, *label_values):
+        """Pour les collecteurs qui recopient un compteur tenu ailleurs (cache, scheduler...)."""
+        self._values[label_values] = value
+
+    def render(self):
+        for values, value in self._values.items():
+            yield f"{self.name}{_labels_text(self.label_names, values)} {value}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS, labels=()):
+        self.name = name; self.help = help_text; self.buckets = tuple(buckets); self.label_names = tuple(labels)
+        self._series = {}
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None: series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value; series[2] += 1
+
+    def render(self):
+        for values, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                labels = _labels_text(self.label_names + ("le",), values + (bound,))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _labels_text(self.label_names, values)
+            yield f"{self.name}_sum{labels} {total}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class Metrics:
+    """Registre minimal de métriques au format texte Prometheus.
+
+    Les `collectors` sont appelés au moment du scrape pour mettre à jour des jauges
+    à partir d'états existants (file du scheduler, cache, conversations...).
+    """
+
+    def __init__(self, log_sample_rate: float = 0.01):
+        self.log_sample_rate = log_sample_rate
+        self._metrics = []
+        self._collectors = []
+        self.gemini_latency = self.histogram("fentdroid_gemini_request_seconds", "Durée complète des appels Gemini.", labels=("mode",))
+        self.gemini_ttft = self.histogram("fentdroid_gemini_time_to_first_token_seconds", "Délai avant le premier chunk streamé.")
+        self.prompt_chars = self.histogram("fentdroid_prompt_chars", "Taille des contents envoyés à Gemini (caractères, hors system_instruction).", SIZE_BUCKETS)
+        self.response_chars = self.histogram("fentdroid_response_chars", "Taille des réponses (caractères).", SIZE_BUCKETS)
+        self.history_items = self.histogram("fentdroid_history_items", "Items d'historique envoyés par tour.", COUNT_BUCKETS)
+        self.queue_wait = self.histogram("fentdroid_queue_wait_seconds", "Attente dans le scheduler avant traitement.", labels=("stage",))
+        self.discord_send = self.histogram("fentdroid_discord_send_seconds", "Durée des envois/éditions de messages Discord.")
+        self.discord_rate_limited = self.counter("fentdroid_discord_rate_limited_total", "Réponses 429 de Discord.")
+        self.replies = self.counter("fentdroid_replies_total", "Tours traités, par issue.", labels=("outcome",))
+        self.loop_lag = self.histogram("fentdroid_event_loop_lag_seconds", "Retard de réveil de la boucle asyncio.")
+        self._lag_task = None
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(name, help_text, labels); self._metrics.append(metric); return metric
+
+    def gauge(self, name, help_text, labels=()):
+        metric = Gauge(name, help_text, labels); self._metrics.append(metric); return metric
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, labels=()):
+        metric = Histogram(name, help_text, buckets, labels); self._metrics.append(metric); return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            try: collector()
+            except Exception as e: logging.warning(f"Collecteur de métriques en échec: {e}")
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def sample_log(self, event: str, **fields):
+        """Log structuré (JSON) échantillonné, à la place des logs INFO par message."""
+        if self.log_sample_rate <= 0 or random.random() >= self.log_sample_rate: return
+        logging.info(json.dumps({"event": event, **fields}, ensure_ascii=False, default=str))
+
+    def start_loop_lag_sampler(self, interval: float = 0.5):
+        async def sample():
+            while True:
+                start = time.perf_counter()
+                await asyncio.sleep(interval)
+                self.loop_lag.observe(max(0.0, time.perf_counter() - start - interval))
+        if self._lag_task is None or self._lag_task.done():
+            self._lag_task = asyncio.get_running_loop().create_task(sample())
+
+    def stop_loop_lag_sampler(self):
+        if self._lag_task is not None: self._lag_task.cancel(); self._lag_task = None
+
+
+class RateLimitLogHandler(logging.Handler):
+    """discord.py gère les 429 en interne et se contente de les logger : on les compte au passage."""
+
+    def __init__(self, counter: Counter):
+        super().__init__(level=logging.WARNING)
+        self.counter = counter
+
+    def emit(self, record):
+        if "rate limited" in record.getMessage(): self.counter.inc()
+
+
+class HealthServer:
+    """Petit serveur HTTP aiohttp sur la boucle du bot : /metrics, /healthz (vivant), /readyz (prêt)."""
+
+    def __init__(self, metrics: Metrics, ready_check, host: str = "127.0.0.1", port: int = 9108):
+        self.metrics = metrics
+        self.ready_check = ready_check
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        app.router.add_get("/healthz", self._healthz)
+        app.router.add_get("/readyz", self._readyz)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info(f"Endpoint métriques/santé sur http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None: await self._runner.cleanup(); self._runner = None
+
+    async def _metrics(self, request):
+        return web.Response(body=self.metrics.render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    async def _healthz(self, request):
+        return web.json_response({"status": "ok"})
+
+    async def _readyz(self, request):
+        checks = self.ready_check()
+        ready = all(checks.values())
+        return web.json_response({"ready": ready, "checks": checks}, status=200 if ready else 503)
@@ -0,0 +1,120 @@
+import asyncio
+import datetime
+import hashlib
+import logging
+from collections import OrderedDict
+
+CACHE_REFRESH_MARGIN = datetime.timedelta(minutes=1)  # recréation du cache serveur avant son expiration
+CACHE_EXPIRY_MARGIN = datetime.timedelta(seconds=10)  # en deçà, le modèle lié au cache n'est plus utilisé
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+class _PoolEntry:
+    __slots__ = ("prompt_hash", "base_model", "cached_model", "cached_content", "cache_expires_at", "cache_task",
+                 "cache_failed")
+
+    def __init__(self, prompt_hash, base_model):
+        self.prompt_hash = prompt_hash
+        self.base_model = base_model
+        self.cached_model = None
+        self.cached_content = None
+        self.cache_expires_at = None
+        self.cache_task = None
+        self.cache_failed = False
+
+
+class ModelPool:
+    """Pool LRU de genai.GenerativeModel, un par (persona, modèle), avec le prompt de la persona en system_instruction.
+
+    Les prompts d'au moins `cache_min_chars` caractères sont mis en cache côté serveur (CachedContent) en
+    arrière-plan ; en attendant (ou si l'API refuse), le modèle avec system_instruction classique est utilisé.
+    Le SDK n'est importé qu'au premier appel (son import coûte ~1 s au démarrage).
+    `wrap_model`, si fourni, est appliqué à chaque modèle construit (ex. ThreadedModel pour le transport REST).
+    """
+
+    def __init__(self, model_name: str, max_models: int = 32, cache_min_chars: int = 0,
+                 cache_ttl_minutes: float = 60, wrap_model=None):
+        self.model_name = model_name
+        self.wrap_model = wrap_model or (lambda model: model)
+        self.max_models = max_models
+        self.cache_min_chars = cache_min_chars
+        self.cache_ttl = datetime.timedelta(minutes=cache_ttl_minutes)
+        self._entries = OrderedDict()
+
+    def __len__(self): return len(self._entries)
+
+    def get(self, persona_id: str, prompt: str, model_name: str = None):
+        """Retourne le modèle `model_name` (par défaut celui du pool) de la persona, reconstruit si son prompt a changé."""
+        model_name = model_name or self.model_name
+        key = (persona_id, model_name)
+        digest = prompt_hash(prompt)
+        entry = self._entries.get(key)
+        if entry is not None and entry.prompt_hash != digest:
+            logging.info(f"Prompt de '{persona_id}' modifié, reconstruction du modèle.")
+            self.invalidate(persona_id); entry = None
+
+        if entry is None:
+            import google.generativeai as genai
+            entry = _PoolEntry(digest, self.wrap_model(genai.GenerativeModel(model_name, system_instruction=prompt)))
+            self._entries[key] = entry
+            self._evict()
+        else:
+            self._entries.move_to_end(key)
+
+        if self.cache_min_chars and len(prompt) >= self.cache_min_chars: self._ensure_cache(key, entry, prompt)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if entry.cached_content is not None and entry.cache_expires_at - now > CACHE_EXPIRY_MARGIN: return entry.cached_model
+        return entry.base_model
+
+    def invalidate(self, persona_id: str):
+        """Oublie les modèles (et caches serveur) d'une persona, après /persona_edit ou /persona_delete."""
+        for key in [k for k in self._entries if k[0] == persona_id]:
+            self._drop_cache(key, self._entries.pop(key))
+
+    def _evict(self):
+        while len(self._entries) > self.max_models:
+            key, entry = self._entries.popitem(last=False)
+            self._drop_cache(key, entry)
+            logging.info(f"Modèle {key[1]} de '{key[0]}' évincé du pool (max={self.max_models}).")
+
+    def _ensure_cache(self, key, entry, prompt):
+        if entry.cache_failed: return
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if entry.cached_content is not None and entry.cache_expires_at - now > CACHE_REFRESH_MARGIN: return
+        if entry.cache_task is not None and not entry.cache_task.done(): return
+        entry.cache_task = asyncio.get_running_loop().create_task(self._create_cache(key, entry, prompt))
+
+    async def _create_cache(self, key, entry, prompt):
+        import google.generativeai as genai
+        from google.generativeai import caching
+        persona_id, model_name = key
+        try:
+            cached = await asyncio.to_thread(
+                caching.CachedContent.create,
+                model=f"models/{model_name}", display_name=f"persona-{persona_id}",
+                system_instruction=prompt, ttl=self.cache_ttl)
+        except Exception as e:
+            logging.warning(f"Cache serveur indisponible pour '{persona_id}', system_instruction classique conservé: {e}")
+            entry.cache_failed = True; return
+        if self._entries.get(key) is not entry:
+            await asyncio.to_thread(cached.delete); return
+        old = entry.cached_content
+        entry.cached_content = cached
+        entry.cache_expires_at = datetime.datetime.now(datetime.timezone.utc) + self.cache_ttl
+        entry.cached_model = self.wrap_model(genai.GenerativeModel.from_cached_content(cached))
+        logging.info(f"Prompt de '{persona_id}' mis en cache côté serveur ({cached.name}).")
+        if old is not None: await asyncio.to_thread(old.delete)
+
+    def _drop_cache(self, key, entry):
+        if entry.cache_task is not None and not entry.cache_task.done(): entry.cache_task.cancel()
+        if entry.cached_content is None: return
+        cached = entry.cached_content; entry.cached_content = None
+
+        async def delete():
+            try: await asyncio.to_thread(cached.delete)
+            except Exception as e: logging.warning(f"Suppression du cache de '{key[0]}' échouée: {e}")
+        try: asyncio.get_running_loop().create_task(delete())
+        except RuntimeError: pass
@@ -0,0 +1,176 @@
+import asyncio
+import datetime
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conv_key TEXT NOT NULL,
+    epoch INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS turns_by_conv ON turns (conv_key, epoch, id);
+CREATE TABLE IF NOT EXISTS conversations (
+    conv_key TEXT PRIMARY KEY,
+    persona_id TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    epoch INTEGER NOT NULL,
+    folded INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def encode_key(key) -> str:
+    return json.dumps(list(key))
+
+
+class ConversationLog:
+    """Journal SQLite (WAL) des conversations, en écriture différée.
+
+    Les tours et changements d'état sont mis en file sans bloquer ; une tâche de fond les écrit par lots.
+    Toutes les opérations SQLite passent par un unique thread dédié, jamais par la boucle asyncio.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0, batch_size: int = 500,
+                 retention_minutes: float = 2, compact_interval_minutes: float = 10, max_load_items: int = 200):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.retention = retention_minutes * 60
+        self.compact_interval = compact_interval_minutes * 60
+        self.max_load_items = max_load_items
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-log")
+        self._db = None
+        self._pending = []
+        self._wakeup = None
+        self._writer_task = None
+        self._last_compact = time.monotonic()
+
+    async def start(self):
+        await self._run(self._open)
+        self._wakeup = asyncio.Event()
+        self._writer_task = asyncio.get_running_loop().create_task(self._writer())
+        logging.info(f"Journal des conversations ouvert: {self.path}")
+
+    @property
+    def running(self) -> bool:
+        return self._writer_task is not None and not self._writer_task.done()
+
+    async def close(self):
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            try: await self._writer_task
+            except asyncio.CancelledError: pass
+            self._writer_task = None
+        await self.flush()
+        if self._db is not None: await self._run(self._db.close); self._db = None
+        self._executor.shutdown(wait=True)
+
+    def turn_appended(self, conversation, user_message: str, response_text: str):
+        now = time.time(); key = encode_key(conversation.key)
+        self._pending.append(("turn", (key, conversation.epoch, "user", user_message, now)))
+        self._pending.append(("turn", (key, conversation.epoch, "model", response_text, now)))
+        self._pending.append(("state", (key, conversation.persona_id, conversation.summary, conversation.epoch,
+                                        conversation.folded, now)))
+        self._wake()
+
+    def conversation_changed(self, conversation):
+        self._pending.append(("state", (encode_key(conversation.key), conversation.persona_id,
+                                        conversation.summary, conversation.epoch, conversation.folded, time.time())))
+        self._wake()
+
+    async def load(self, key):
+        """Lit l'état et les derniers tours d'une conversation, ou None si elle est inconnue.
+
+        Pour une conversation expirée, seule son epoch est retournée (avec "expired": True) : la suivante doit
+        repartir au-delà, ses anciens tours restant en base jusqu'à la prochaine compaction."""
+        key = encode_key(key)
+        if any(row[0] == key for _, row in self._pending): await self.flush()  # écritures encore en file
+        return await self._run(self._load, key)
+
+    async def flush(self):
+        while self._pending:
+            batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+            try: await self._run(self._write, batch)
+            except Exception as e: logging.error(f"Écriture du journal des conversations échouée ({len(batch)} entrées perdues): {e}")
+
+    async def compact(self):
+        """Supprime les conversations inactives depuis plus que la fenêtre d'inactivité et les tours périmés."""
+        removed = await self._run(self._compact, time.time() - self.retention)
+        self._last_compact = time.monotonic()
+        if removed: logging.info(f"Compaction du journal: {removed} ligne(s) supprimée(s).")
+        return removed
+
+    def _wake(self):
+        if self._wakeup is not None and len(self._pending) >= self.batch_size: self._wakeup.set()
+
+    async def _writer(self):
+        while True:
+            try: await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError: pass
+            self._wakeup.clear()
+            await self.flush()
+            if time.monotonic() - self._last_compact >= self.compact_interval:
+                try: await self.compact()
+                except Exception as e: logging.error(f"Compaction du journal échouée: {e}")
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _open(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA busy_timeout=5000")  # base partagée entre processus en mode multi-shards
+        self._db.executescript(SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(conversations)")}
+        if "folded" not in columns:  # base créée avant le suivi des tours résumés
+            with self._db: self._db.execute("ALTER TABLE conversations ADD COLUMN folded INTEGER NOT NULL DEFAULT 0")
+
+    def _write(self, batch):
+        turns = [row for kind, row in batch if kind == "turn"]
+        states = {}
+        for kind, row in batch:
+            if kind == "state": states[row[0]] = row
+        with self._db:
+            if turns:
+                self._db.executemany("INSERT INTO turns (conv_key, epoch, role, content, created_at) VALUES (?, ?, ?, ?, ?)", turns)
+            if states:
+                self._db.executemany(
+                    "INSERT INTO conversations (conv_key, persona_id, summary, epoch, folded, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(conv_key) DO UPDATE SET persona_id=excluded.persona_id, summary=excluded.summary, "
+                    "epoch=excluded.epoch, folded=excluded.folded, updated_at=excluded.updated_at", list(states.values()))
+
+    def _load(self, key: str):
+        row = self._db.execute("SELECT persona_id, summary, epoch, folded, updated_at FROM conversations WHERE conv_key = ?",
+                               (key,)).fetchone()
+        if row is None: return None
+        persona_id, summary, epoch, folded, updated_at = row
+        if updated_at < time.time() - self.retention: return {"expired": True, "epoch": epoch}
+        # Les `folded` premiers tours de l'epoch sont déjà dans le résumé ; au-delà de max_load_items, les plus anciens sont perdus.
+        count = self._db.execute("SELECT COUNT(*) FROM turns WHERE conv_key = ? AND epoch = ?", (key, epoch)).fetchone()[0]
+        skipped = max(folded, count - self.max_load_items)
+        rows = self._db.execute(
+            "SELECT role, content FROM turns WHERE conv_key = ? AND epoch = ? ORDER BY id LIMIT -1 OFFSET ?",
+            (key, epoch, skipped)).fetchall()
+        turns = [{"role": role, "parts": [content]} for role, content in rows]
+        if turns and turns[0]["role"] != "user": turns = turns[1:]; skipped += 1
+        return {"persona_id": persona_id, "summary": summary, "epoch": epoch, "folded": skipped, "turns": turns,
+                "last_message_timestamp": datetime.datetime.fromtimestamp(updated_at, timezone.utc)}
+
+    def _compact(self, cutoff: float) -> int:
+        with self._db:
+            removed = self._db.execute(
+                "DELETE FROM turns WHERE conv_key IN (SELECT conv_key FROM conversations WHERE updated_at < ?)", (cutoff,)).rowcount
+            removed += self._db.execute(
+                "DELETE FROM turns WHERE epoch < (SELECT c.epoch FROM conversations c WHERE c.conv_key = turns.conv_key)").rowcount
+            removed += self._db.execute("DELETE FROM conversations WHERE updated_at < ?", (cutoff,)).rowcount
+        return removed
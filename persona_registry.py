@@ -0,0 +1,99 @@
+import bisect
+import logging
+import unicodedata
+from collections import Counter
+
+
+def normalize(text: str) -> str:
+    """Minuscules sans accents, pour comparer 'Éric' et 'eric'."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower().strip()
+
+
+def trigrams(text: str):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class PersonaIndex:
+    """Index de recherche sur les IDs et noms des personas, pour l'autocomplétion des commandes.
+
+    Préfixes : liste triée de termes (ID, nom complet, chaque mot du nom) parcourue par bisect.
+    Approximatif : index de trigrammes, utilisé quand les préfixes ne suffisent pas à remplir la liste.
+    Les mises à jour sont incrémentales (update/remove), sans reconstruction complète.
+    """
+
+    def __init__(self, personas: dict = None):
+        self._terms = []
+        self._terms_by_id = {}
+        self._trigrams = {}
+        self._trigrams_by_id = {}
+        self._ids = []
+        if personas: self.rebuild(personas)
+
+    def __len__(self): return len(self._ids)
+
+    def rebuild(self, personas: dict):
+        self._terms = []; self._terms_by_id = {}; self._trigrams = {}; self._trigrams_by_id = {}; self._ids = []
+        for persona_id, persona in personas.items(): self._add(persona_id, persona, sort=False)
+        self._terms.sort(); self._ids.sort()
+        logging.info(f"Index des personas construit ({len(self._ids)} personas, {len(self._terms)} termes).")
+
+    def update(self, persona_id: str, persona: dict):
+        self.remove(persona_id)
+        self._add(persona_id, persona, sort=True)
+
+    def remove(self, persona_id: str):
+        for term in self._terms_by_id.pop(persona_id, ()):
+            i = bisect.bisect_left(self._terms, (term, persona_id))
+            if i < len(self._terms) and self._terms[i] == (term, persona_id): del self._terms[i]
+        for gram in self._trigrams_by_id.pop(persona_id, ()):
+            ids = self._trigrams.get(gram)
+            if ids is not None:
+                ids.discard(persona_id)
+                if not ids: del self._trigrams[gram]
+        i = bisect.bisect_left(self._ids, persona_id)
+        if i < len(self._ids) and self._ids[i] == persona_id: del self._ids[i]
+
+    def ids(self):
+        """IDs triés, pour la pagination de /personas."""
+        return self._ids
+
+    def search(self, query: str, limit: int = 25):
+        """IDs correspondant à `query` : d'abord les préfixes, puis les correspondances approximatives."""
+        query = normalize(query)
+        if not query: return self._ids[:limit]
+
+        results = []; seen = set()
+        i = bisect.bisect_left(self._terms, (query,))
+        while i < len(self._terms) and len(results) < limit:
+            term, persona_id = self._terms[i]
+            if not term.startswith(query): break
+            if persona_id not in seen: seen.add(persona_id); results.append(persona_id)
+            i += 1
+        if len(results) >= limit: return results
+
+        grams = trigrams(query)
+        scores = Counter()
+        for gram in grams:
+            for persona_id in self._trigrams.get(gram, ()): scores[persona_id] += 1
+        threshold = max(1, len(grams) // 2)
+        for persona_id, score in scores.most_common():
+            if score < threshold or len(results) >= limit: break
+            if persona_id not in seen: seen.add(persona_id); results.append(persona_id)
+        return results
+
+    def _add(self, persona_id: str, persona: dict, sort: bool):
+        name = normalize(persona.get("name", "")) if isinstance(persona, dict) else ""
+        norm_id = normalize(persona_id)
+        terms = {norm_id, name, *name.split()} - {""}
+        grams = trigrams(norm_id) | (trigrams(name) if name else set())
+        self._terms_by_id[persona_id] = terms
+        self._trigrams_by_id[persona_id] = grams
+        for gram in grams: self._trigrams.setdefault(gram, set()).add(persona_id)
+        if sort:
+            for term in terms: bisect.insort(self._terms, (term, persona_id))
+            bisect.insort(self._ids, persona_id)
+        else:
+            self._terms.extend((term, persona_id) for term in terms)
+            self._ids.append(persona_id)
@@ -0,0 +1,256 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import asynccontextmanager
+
+DEFAULT_PERSONA = {"name": "Fent-Droid (Défaut)", "description": "Base", "prompt": "IA de base."}
+
+
+def persona_digest(persona: dict) -> str:
+    return hashlib.sha256(json.dumps(persona, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def write_atomic(path: str, data: str):
+    """Écrit dans un fichier temporaire du même dossier puis le renomme : le fichier n'est jamais à moitié écrit.
+
+    Retourne la signature (mtime_ns, taille) du fichier écrit, prise avant le renommage."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=os.path.basename(path), dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(data); f.flush(); os.fsync(f.fileno())
+            st = os.fstat(f.fileno())
+        os.replace(tmp_path, path)
+        return (st.st_mtime_ns, st.st_size)
+    except BaseException:
+        try: os.unlink(tmp_path)
+        except OSError: pass
+        raise
+
+
+class PersonaRepository:
+    """Source des personnalités : personas.json + prompt.txt (prompt de 'default').
+
+    - save() regroupe les modifications rapprochées et écrit hors de la boucle, de façon atomique ;
+    - watch() recharge les fichiers modifiés à la main (mtime puis hash) sans redémarrage ;
+    - on_change(changed_ids, removed_ids) n'est appelé que pour les personas réellement modifiées ;
+    - on_saved(changed_ids, removed_ids) est appelé après chaque écriture de nos propres modifications.
+
+    Si un autre processus a écrit le fichier depuis notre dernière lecture, save() repart du fichier
+    et n'y rejoue que nos modifications, au lieu d'écraser les siennes.
+    Quand prompt.txt n'est pas vide, il fait foi pour le prompt de 'default', qui n'est alors pas écrit dans personas.json.
+    """
+
+    def __init__(self, personas_file: str, prompt_file: str = "prompt.txt", save_delay: float = 1.0,
+                 reload_interval: float = 5.0, on_change=None, on_saved=None):
+        self.personas_file = personas_file
+        self.prompt_file = prompt_file
+        self.save_delay = save_delay
+        self.reload_interval = reload_interval
+        self.on_change = on_change
+        self.on_saved = on_saved
+        self.personas = {}
+        self._digests = {}
+        self._file_signatures = {}
+        self._file_hashes = {}
+        self._save_task = None
+        self._watch_task = None
+        self._dirty = False
+        self._read_ok = True
+        self._prompt_from_file = False
+
+    def load(self) -> dict:
+        """Charge les fichiers et met à jour self.personas sur place. Retourne le dict des personas."""
+        logging.info("Début chargement personnalités...")
+        loaded = self._read_files()
+        changed, removed = self._apply(loaded)
+        logging.info(f"{len(self.personas)} personnalités dans bot.personas après chargement.")
+        if not os.path.exists(self.personas_file):
+            logging.info(f"{self.personas_file} non trouvé. Création avec default seulement.")
+            try: write_atomic(self.personas_file, self._serialize()); self._remember_file(self.personas_file)
+            except Exception as e: logging.error(f"Erreur lors de la sauvegarde de bot.personas: {e}")
+        return self.personas
+
+    def save(self):
+        """Programme une sauvegarde différée ; plusieurs appels rapprochés ne donnent qu'une écriture."""
+        self._dirty = True
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.get_running_loop().create_task(self._save_later())
+
+    async def flush(self):
+        """Écrit immédiatement les modifications en attente (à l'arrêt du bot)."""
+        if self._save_task is not None and not self._save_task.done():
+            self._save_task.cancel()
+            try: await self._save_task  # libère le verrou ; une écriture interrompue a remis _dirty
+            except asyncio.CancelledError: pass
+        if self._dirty: await self._write()
+
+    def start_watching(self):
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.get_running_loop().create_task(self._watch())
+
+    def stop_watching(self):
+        if self._watch_task is not None: self._watch_task.cancel(); self._watch_task = None
+
+    async def reload_if_changed(self) -> bool:
+        """Recharge si personas.json ou prompt.txt a changé sur disque (hors de nos propres écritures)."""
+        if self._dirty: return False
+        changed_files = await asyncio.to_thread(self._changed_files)
+        if not changed_files: return False
+        logging.info(f"Modification détectée sur {', '.join(changed_files)}. Rechargement des personnalités...")
+        loaded = await asyncio.to_thread(self._read_files)
+        if self._dirty: return False
+        changed, removed = self._apply(loaded)
+        if changed or removed:
+            logging.info(f"Personnalités rechargées: modifiées={sorted(changed)}, supprimées={sorted(removed)}")
+            if self.on_change: self.on_change(changed, removed)
+        return True
+
+    async def _save_later(self):
+        while self._dirty:  # save() appelée pendant une écriture : on repasse
+            await asyncio.sleep(self.save_delay)
+            await self._write()
+
+    async def _write(self):
+        self._dirty = False
+        changed, removed = self._local_changes()
+        try:
+            async with self._file_lock():
+                if self.personas_file in await asyncio.to_thread(self._changed_files):
+                    await self._merge_from_disk(changed, removed)
+                late_changed, late_removed = self._local_changes()  # modifiées pendant les attentes ci-dessus
+                changed |= late_changed; removed |= late_removed
+                # Empreintes prises sur l'état sérialisé : une modification faite pendant l'écriture reste à sauvegarder.
+                data = self._serialize()
+                digests = {k: persona_digest(v) for k, v in self.personas.items()}
+                signature = await asyncio.to_thread(write_atomic, self.personas_file, data)
+            self._file_signatures[self.personas_file] = signature
+            self._file_hashes[self.personas_file] = hashlib.sha256(data.encode("utf-8")).hexdigest()
+            self._digests = digests
+            logging.info(f"Sauvegarde réussie ({len(self.personas)} personnalités).")
+        except asyncio.CancelledError:
+            self._dirty = True; raise
+        except Exception as e:
+            self._dirty = True
+            logging.error(f"Erreur lors de la sauvegarde de bot.personas: {e}")
+            return
+        if self.on_saved and (changed or removed): self.on_saved(changed, removed)
+
+    @asynccontextmanager
+    async def _file_lock(self, stale_after: float = 10.0):
+        """Verrou entre processus (fichier créé en exclusif) autour de la relecture + écriture de personas.json."""
+        lock_path = self.personas_file + ".lock"
+        while True:
+            try: fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY); break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) > stale_after: os.unlink(lock_path); continue
+                except OSError: continue
+                await asyncio.sleep(0.05)
+        try: yield
+        finally:
+            os.close(fd)
+            try: os.unlink(lock_path)
+            except OSError: pass
+
+    def _local_changes(self):
+        """Personas modifiées ou supprimées en mémoire depuis la dernière lecture/écriture du fichier."""
+        digests = {k: persona_digest(v) for k, v in self.personas.items()}
+        return {k for k, d in digests.items() if self._digests.get(k) != d}, set(self._digests) - set(digests)
+
+    async def _merge_from_disk(self, changed, removed):
+        loaded = await asyncio.to_thread(self._read_files)
+        if not self._read_ok:
+            logging.warning(f"{self.personas_file} modifié par ailleurs mais illisible : il sera écrasé."); return
+        for k in removed: loaded.pop(k, None)
+        for k in changed: loaded[k] = self.personas[k]
+        external_changed, external_removed = self._apply(loaded)
+        external_changed -= changed; external_removed -= removed
+        if external_changed or external_removed:
+            logging.info(f"Modifications concurrentes conservées: modifiées={sorted(external_changed)}, supprimées={sorted(external_removed)}")
+            if self.on_change: self.on_change(external_changed, external_removed)
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try: await self.reload_if_changed()
+            except Exception as e: logging.error(f"Erreur rechargement à chaud des personnalités: {e}")
+
+    def _serialize(self) -> str:
+        personas = self.personas
+        if self._prompt_from_file and "default" in personas:
+            personas = {**personas, "default": {k: v for k, v in personas["default"].items() if k != "prompt"}}
+        return json.dumps(personas, ensure_ascii=False, indent=4)
+
+    def _read_files(self) -> dict:
+        personas = {"default": dict(DEFAULT_PERSONA)}
+        self._read_ok = True
+        default_prompt = ""
+        try:
+            with open(self.prompt_file, "r", encoding="utf-8") as f:
+                default_prompt = f.read().strip()
+            if default_prompt:
+                personas["default"]["prompt"] = default_prompt
+                logging.info(f"Prompt default chargé depuis {self.prompt_file}.")
+            else: logging.warning(f"{self.prompt_file} vide.")
+        except FileNotFoundError: logging.warning(f"{self.prompt_file} non trouvé.")
+        except Exception as e: logging.error(f"Erreur lecture {self.prompt_file}: {e}")
+        self._remember_file(self.prompt_file)
+
+        try:
+            if os.path.exists(self.personas_file):
+                logging.info(f"Chargement {self.personas_file}...")
+                with open(self.personas_file, "r", encoding="utf-8") as f:
+                    loaded = json.load(f)
+                if isinstance(loaded, dict):
+                    valid_personas = {k: v for k, v in loaded.items() if isinstance(v, dict)}
+                    default_in_file = valid_personas.pop("default", None)
+                    personas.update(valid_personas)
+                    if default_in_file:
+                        if not default_in_file.get("prompt"):
+                            default_in_file["prompt"] = personas["default"]["prompt"]
+                        personas["default"].update(default_in_file)
+                    logging.info(f"{len(valid_personas)} (+default) personnalités chargées/mises à jour depuis {self.personas_file}.")
+                else: self._read_ok = False; logging.warning(f"Format incorrect {self.personas_file}.")
+                self._remember_file(self.personas_file)
+        except json.JSONDecodeError as e: self._read_ok = False; logging.error(f"Erreur JSON {self.personas_file}: {e}")
+        except Exception as e: self._read_ok = False; logging.error(f"Erreur chargement {self.personas_file}: {e}")
+        if default_prompt: personas["default"]["prompt"] = default_prompt  # prompt.txt l'emporte sur personas.json
+        self._prompt_from_file = bool(default_prompt)
+        return personas
+
+    def _apply(self, loaded: dict):
+        digests = {k: persona_digest(v) for k, v in loaded.items()}
+        changed = {k for k, d in digests.items() if self._digests.get(k) != d}
+        removed = set(self._digests) - set(digests)
+        for k in removed: self.personas.pop(k, None)
+        for k in changed: self.personas[k] = loaded[k]
+        self._digests = digests
+        return changed, removed
+
+    def _signature(self, path):
+        try: st = os.stat(path)
+        except FileNotFoundError: return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _remember_file(self, path):
+        self._file_signatures[path] = self._signature(path)
+        self._file_hashes[path] = self._hash_file(path)
+
+    def _hash_file(self, path):
+        try:
+            with open(path, "rb") as f: return hashlib.sha256(f.read()).hexdigest()
+        except FileNotFoundError: return None
+
+    def _changed_files(self):
+        changed = []
+        for path in (self.personas_file, self.prompt_file):
+            signature = self._signature(path)
+            if signature == self._file_signatures.get(path): continue
+            self._file_signatures[path] = signature
+            if self._hash_file(path) != self._file_hashes.get(path): changed.append(path)
+        return changed
@@ -0,0 +1,73 @@
+import hashlib
+import re
+import time
+from collections import OrderedDict
+
+from persona_registry import normalize
+
+_WHITESPACE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = " \t\n.,;:!?…'\"«»"
+
+
+def normalize_message(text: str) -> str:
+    """Normalise un message pour la clé de cache : casse, accents, espaces et ponctuation de fin."""
+    return _WHITESPACE.sub(" ", normalize(text)).strip(_EDGE_PUNCTUATION)
+
+
+class ResponseCache:
+    """Cache exact des réponses Gemini, borné en nombre d'entrées et en caractères, avec TTL et éviction LRU.
+
+    La clé couvre la persona (ID + hash du prompt), la fin de l'historique et le message, tous normalisés.
+    Le cache est opt-in : seules les personas avec "cache_responses": true l'utilisent.
+    """
+
+    def __init__(self, max_entries: int = 1000, max_chars: int = 2_000_000, ttl_seconds: float = 600, tail_items: int = 2):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.ttl = ttl_seconds
+        self.tail_items = tail_items
+        self._entries = OrderedDict()
+        self._chars = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self): return len(self._entries)
+
+    @staticmethod
+    def enabled_for(persona: dict) -> bool:
+        return bool(persona.get("cache_responses"))
+
+    def key(self, persona_id: str, prompt_digest: str, history, message: str) -> str:
+        tail = list(history)[-self.tail_items:] if self.tail_items else []
+        parts = [persona_id, prompt_digest]
+        parts += [f"{turn.get('role')}:{normalize_message(' '.join(p for p in turn.get('parts', []) if isinstance(p, str)))}" for turn in tail]
+        parts.append(normalize_message(message))
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1; return None
+        expires_at, text = entry
+        if expires_at < time.monotonic():
+            self._remove(key); self.misses += 1; return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return text
+
+    def put(self, key: str, text: str):
+        if not text or len(text) > self.max_chars: return
+        self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, text)
+        self._chars += len(text)
+        while len(self._entries) > self.max_entries or self._chars > self.max_chars:
+            oldest = next(iter(self._entries)); self._remove(oldest)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"entries": len(self._entries), "chars": self._chars, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0}
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None: self._chars -= len(entry[1])
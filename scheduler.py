@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class SchedulerBusy(Exception):
+    """Levée quand la file d'attente des requêtes LLM est pleine."""
+
+
+class Scheduler:
+    """Limite les appels LLM simultanés et sérialise les tours d'une même conversation.
+
+    - un verrou par conversation (slot) garantit que les tours sont appliqués dans l'ordre d'arrivée ;
+    - un sémaphore global (llm) plafonne les requêtes Gemini en cours ;
+    - au-delà de max_waiting requêtes en attente, les nouvelles sont rejetées (SchedulerBusy).
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_waiting: int = 32, wait_samples: int = 500):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._locks = {}
+        self._lock_users = {}
+        self._turn_waits = deque(maxlen=wait_samples)
+        self._llm_waits = deque(maxlen=wait_samples)
+        self.waiting = 0
+        self.in_flight = 0
+        self.shed_count = 0
+        self.completed = 0
+
+    @asynccontextmanager
+    async def slot(self, key):
+        """Attend le tour de la conversation `key` (les tours sont servis dans l'ordre d'arrivée)."""
+        if self.waiting >= self.max_waiting:
+            self.shed_count += 1
+            logging.warning(f"File LLM pleine ({self.waiting}/{self.max_waiting}). Requête rejetée pour {key}.")
+            raise SchedulerBusy()
+
+        lock = self._locks.get(key)
+        if lock is None: lock = self._locks[key] = asyncio.Lock()
+        self._lock_users[key] = self._lock_users.get(key, 0) + 1
+        try:
+            async with self._waiting(self._turn_waits, lock):
+                yield
+        finally:
+            self._lock_users[key] -= 1
+            if not self._lock_users[key]:
+                del self._lock_users[key]
+                self._locks.pop(key, None)
+
+    @asynccontextmanager
+    async def llm(self):
+        """Réserve une des max_concurrent places pour un appel Gemini."""
+        async with self._waiting(self._llm_waits, self._semaphore):
+            self.in_flight += 1
+            try: yield
+            finally:
+                self.in_flight -= 1
+                self.completed += 1
+
+    @asynccontextmanager
+    async def _waiting(self, samples, primitive):
+        self.waiting += 1
+        start = time.monotonic()
+        try: await primitive.acquire()
+        finally: self.waiting -= 1
+        samples.append(time.monotonic() - start)
+        try: yield
+        finally: primitive.release()
+
+    def stats(self) -> dict:
+        """Profondeur de file et temps d'attente (secondes), pour ajuster les limites."""
+        turn_waits = sorted(self._turn_waits); llm_waits = sorted(self._llm_waits)
+        def pct(waits, p): return waits[min(len(waits) - 1, int(p * len(waits)))] if waits else 0.0
+        return {
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+            "max_concurrent": self.max_concurrent,
+            "max_waiting": self.max_waiting,
+            "completed": self.completed,
+            "shed": self.shed_count,
+            "turn_wait_p50": pct(turn_waits, 0.50),
+            "turn_wait_p95": pct(turn_waits, 0.95),
+            "llm_wait_p50": pct(llm_waits, 0.50),
+            "llm_wait_p95": pct(llm_waits, 0.95),
+            "llm_wait_max": llm_waits[-1] if llm_waits else 0.0,
+        }
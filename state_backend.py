@@ -0,0 +1,218 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from persistence import ConversationLog
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS persona_events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    origin TEXT NOT NULL,
+    changed TEXT NOT NULL,
+    removed TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS worker_status (
+    worker TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def json_safe(value):
+    """Remplace les flottants non finis (latence d'un shard pas encore connecté...) par None."""
+    if isinstance(value, float) and not math.isfinite(value): return None
+    if isinstance(value, dict): return {str(k): json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)): return [json_safe(v) for v in value]
+    return value
+
+
+def aggregate_status(statuses: dict) -> dict:
+    """Vue d'ensemble de tous les processus à partir de leurs statuts individuels."""
+    shards = {}
+    for status in statuses.values(): shards.update(status.get("shards", {}))
+    def total(name): return sum(status.get(name, 0) for status in statuses.values())
+    def scheduler_total(name): return sum(status.get("scheduler", {}).get(name, 0) for status in statuses.values())
+    return {
+        "workers": len(statuses),
+        "workers_ready": sum(1 for status in statuses.values() if status.get("ready")),
+        "shards": len(shards),
+        "shards_ready": sum(1 for shard in shards.values() if shard.get("ready")),
+        "shard_count": max((status.get("shard_count") or 0 for status in statuses.values()), default=0),
+        "guilds": total("guilds"),
+        "conversations": total("conversations"),
+        "llm_waiting": scheduler_total("waiting"),
+        "llm_in_flight": scheduler_total("in_flight"),
+        "llm_shed": scheduler_total("shed"),
+        "per_worker": statuses,
+    }
+
+
+class StateBackend:
+    """État partagé entre les processus du bot : journal des conversations, diffusion des changements
+    de personas et statut de chaque processus.
+
+    - `conversation_log` : journal passé au ConversationStore (None = conversations en mémoire seulement) ;
+    - `publish_personas(changed, removed)` : prévient les autres processus après une sauvegarde des personas ;
+      chez eux, `on_persona_event(changed, removed)` (coroutine) est appelée ;
+    - `status_provider()` est publié périodiquement ; `statuses()` retourne le dernier statut de chaque processus.
+    """
+
+    conversation_log = None
+
+    def __init__(self, worker_id: str = "0", on_persona_event=None, status_provider=None):
+        self.worker_id = worker_id
+        self.on_persona_event = on_persona_event
+        self.status_provider = status_provider
+
+    @property
+    def running(self) -> bool:
+        return True
+
+    async def start(self): pass
+
+    async def close(self): pass
+
+    def publish_personas(self, changed, removed): pass
+
+    async def statuses(self) -> dict:
+        return {self.worker_id: self._own_status()} if self.status_provider else {}
+
+    def _own_status(self) -> dict:
+        return json_safe({**self.status_provider(), "updated_at": time.time()})
+
+
+class MemoryBackend(StateBackend):
+    """Un seul processus, rien n'est persisté : les conversations vivent en mémoire, les changements
+    de personas n'ont personne à prévenir."""
+
+
+class SQLiteBackend(StateBackend):
+    """Base SQLite (WAL) partagée par tous les processus d'une même machine.
+
+    Les conversations passent par le ConversationLog habituel (une conversation n'est servie que par le shard
+    de sa guilde, mais reste rechargeable après un redécoupage). Les changements de personas sont écrits dans
+    une table d'événements que chaque processus relit toutes les `poll_interval` secondes.
+    """
+
+    def __init__(self, path: str, worker_id: str = "0", on_persona_event=None, status_provider=None,
+                 poll_interval: float = 1.0, status_interval: float = 5.0, status_max_age: float = 30.0,
+                 event_retention_seconds: float = 3600, log_options: dict = None):
+        super().__init__(worker_id, on_persona_event, status_provider)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.status_interval = status_interval
+        self.status_max_age = status_max_age
+        self.event_retention = event_retention_seconds
+        self.origin = f"{worker_id}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.conversation_log = ConversationLog(path, **(log_options or {}))
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-backend")
+        self._db = None
+        self._last_seq = 0
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done() and self.conversation_log.running
+
+    async def start(self):
+        await self.conversation_log.start()
+        self._last_seq = await self._run(self._open)
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+        logging.info(f"État partagé SQLite ouvert: {self.path} (processus {self.origin})")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+        if self._db is not None:
+            try: await self._run(self._delete_status)
+            except Exception as e: logging.warning(f"Statut du processus {self.worker_id} non retiré: {e}")
+            await self._run(self._db.close); self._db = None
+        self._executor.shutdown(wait=True)
+        await self.conversation_log.close()
+
+    def publish_personas(self, changed, removed):
+        if self._db is None or not (changed or removed): return
+        future = asyncio.get_running_loop().run_in_executor(self._executor, self._insert_event, sorted(changed), sorted(removed))
+        future.add_done_callback(self._log_failure)
+
+    async def statuses(self) -> dict:
+        if self._db is None: return await super().statuses()
+        rows = await self._run(self._read_statuses, time.time() - self.status_max_age)
+        return {worker: json.loads(status) for worker, status in rows}
+
+    async def _loop(self):
+        last_status = 0.0
+        while True:
+            try:
+                await self._poll_events()
+                if self.status_provider and time.monotonic() - last_status >= self.status_interval:
+                    last_status = time.monotonic()
+                    await self._run(self._write_status, json.dumps(self._own_status(), default=str))
+            except Exception as e: logging.error(f"Erreur synchronisation de l'état partagé: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _poll_events(self):
+        events = await self._run(self._read_events, self._last_seq)
+        for seq, origin, changed, removed in events:
+            self._last_seq = seq
+            if origin == self.origin or self.on_persona_event is None: continue
+            changed, removed = set(json.loads(changed)), set(json.loads(removed))
+            logging.info(f"Personas modifiées par un autre processus: modifiées={sorted(changed)}, supprimées={sorted(removed)}")
+            await self.on_persona_event(changed, removed)
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    @staticmethod
+    def _log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.error(f"Diffusion d'un changement de personas échouée: {future.exception()}")
+
+    def _open(self) -> int:
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.executescript(SCHEMA)
+        with self._db:
+            self._db.execute("DELETE FROM persona_events WHERE created_at < ?", (time.time() - self.event_retention,))
+        return self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM persona_events").fetchone()[0]
+
+    def _insert_event(self, changed, removed):
+        with self._db:
+            self._db.execute("INSERT INTO persona_events (origin, changed, removed, created_at) VALUES (?, ?, ?, ?)",
+                             (self.origin, json.dumps(changed), json.dumps(removed), time.time()))
+
+    def _read_events(self, after_seq: int):
+        return self._db.execute("SELECT seq, origin, changed, removed FROM persona_events WHERE seq > ? ORDER BY seq",
+                                (after_seq,)).fetchall()
+
+    def _write_status(self, status: str):
+        with self._db:
+            self._db.execute("INSERT INTO worker_status (worker, status, updated_at) VALUES (?, ?, ?) "
+                             "ON CONFLICT(worker) DO UPDATE SET status=excluded.status, updated_at=excluded.updated_at",
+                             (self.worker_id, status, time.time()))
+
+    def _delete_status(self):
+        with self._db: self._db.execute("DELETE FROM worker_status WHERE worker = ?", (self.worker_id,))
+
+    def _read_statuses(self, cutoff: float):
+        return self._db.execute("SELECT worker, status FROM worker_status WHERE updated_at >= ? ORDER BY worker",
+                                (cutoff,)).fetchall()
+
+
+def make_backend(kind: str, path: str, log_options: dict = None, **options) -> StateBackend:
+    """`kind` : "sqlite" (défaut, partagé entre processus) ou "memory" (un seul processus, sans persistance)."""
+    if kind == "memory": return MemoryBackend(**options)
+    if kind == "sqlite": return SQLiteBackend(path, log_options=log_options, **options)
+    raise ValueError(f"STATE_BACKEND inconnu: {kind!r} (attendu: sqlite ou memory)")
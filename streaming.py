@@ -0,0 +1,62 @@
+import logging
+import time
+
+DISCORD_MESSAGE_LIMIT = 2000
+
+
+class StreamingReply:
+    """Affiche une réponse Gemini au fil de l'eau en éditant des messages Discord.
+
+    Le premier message est posté dès les premiers tokens, puis édité au plus une fois toutes les
+    `edit_interval` secondes (les éditions Discord sont limitées à ~5 / 5s par salon).
+    Au-delà de 2000 caractères, le message courant est figé et un nouveau message prend le relais.
+    `on_send(secondes)` est appelé après chaque envoi ou édition (métriques).
+    """
+
+    def __init__(self, message, edit_interval: float = 1.2, limit: int = DISCORD_MESSAGE_LIMIT, on_send=None):
+        self.message = message
+        self.on_send = on_send
+        self.edit_interval = edit_interval
+        self.limit = limit
+        self.text = ""
+        self._segment_start = 0
+        self._current = None
+        self._shown = ""
+        self._last_edit = 0.0
+        self.sent_messages = []
+
+    async def feed(self, chunk: str):
+        if not chunk: return
+        self.text += chunk
+        if self._current is None or time.monotonic() - self._last_edit >= self.edit_interval:
+            await self._flush()
+
+    async def finish(self) -> str:
+        """Pousse le texte restant et retourne la réponse complète."""
+        if self.text: await self._flush()
+        return self.text
+
+    async def _flush(self):
+        while len(self.text) - self._segment_start > self.limit:
+            segment = self.text[self._segment_start:self._segment_start + self.limit]
+            await self._show(segment)
+            self._segment_start += self.limit
+            self._current = None; self._shown = ""
+        segment = self.text[self._segment_start:]
+        if segment.strip(): await self._show(segment)
+
+    async def _show(self, segment: str):
+        if segment == self._shown: return
+        start = time.monotonic()
+        if self._current is None:
+            if not self.sent_messages:
+                self._current = await self.message.reply(segment, mention_author=False)
+            else:
+                self._current = await self.message.channel.send(segment)
+            self.sent_messages.append(self._current)
+        else:
+            await self._current.edit(content=segment)
+        self._shown = segment
+        self._last_edit = time.monotonic()
+        if self.on_send: self.on_send(self._last_edit - start)
+        logging.debug(f"Stream: {len(self.text)} caractères affichés sur {len(self.sent_messages)} message(s).")
@@ -0,0 +1,184 @@
+"""Lance le bot en plusieurs processus, chacun gérant un groupe de shards Discord.
+
+    python supervisor.py --workers 4             # nombre de shards recommandé par Discord
+    python supervisor.py --workers 2 --shards 8
+
+Chaque processus est un `python bot.py` ordinaire avec SHARD_COUNT, SHARD_IDS et WORKER_ID dans son
+environnement ; personas et conversations passent par la base SQLite partagée (STATE_BACKEND=sqlite).
+Un processus qui s'arrête est relancé (backoff exponentiel). La vue agrégée de tous les shards est servie
+en JSON sur http://METRICS_HOST:METRICS_PORT/status ; chaque processus garde son /metrics sur METRICS_PORT+1+n.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+from dotenv import load_dotenv
+
+from state_backend import SQLiteBackend, aggregate_status
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - [supervisor] %(message)s')
+
+DISCORD_GATEWAY_BOT_URL = "https://discord.com/api/v10/gateway/bot"
+RESTART_MAX_DELAY_SECONDS = 60
+STABLE_RUN_SECONDS = 60
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+
+
+def shard_groups(shard_count: int, workers: int):
+    """Répartit les shards 0..shard_count-1 en `workers` groupes contigus de tailles proches."""
+    workers = max(1, min(workers, shard_count))
+    size, extra = divmod(shard_count, workers)
+    groups, start = [], 0
+    for index in range(workers):
+        end = start + size + (1 if index < extra else 0)
+        groups.append(list(range(start, end))); start = end
+    return groups
+
+
+async def recommended_shard_count(token: str) -> int:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(DISCORD_GATEWAY_BOT_URL, headers={"Authorization": f"Bot {token}"}) as response:
+            response.raise_for_status()
+            return int((await response.json())["shards"])
+
+
+class Worker:
+    def __init__(self, worker_id: int, shard_ids, shard_count: int, metrics_port: int):
+        self.worker_id = worker_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.metrics_port = metrics_port
+        self.process = None
+        self.started_at = 0.0
+        self.restarts = 0
+
+    def environment(self) -> dict:
+        return {**os.environ, "STATE_BACKEND": "sqlite", "WORKER_ID": str(self.worker_id),
+                "SHARD_COUNT": str(self.shard_count), "SHARD_IDS": ",".join(map(str, self.shard_ids)),
+                "METRICS_PORT": str(self.metrics_port)}
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(sys.executable, BOT_SCRIPT, env=self.environment())
+        self.started_at = time.monotonic()
+        logging.info(f"Processus {self.worker_id} lancé (pid {self.process.pid}, shards {self.shard_ids}).")
+
+    def info(self) -> dict:
+        running = self.process is not None and self.process.returncode is None
+        return {"pid": self.process.pid if self.process else None, "running": running,
+                "shard_ids": self.shard_ids, "restarts": self.restarts}
+
+
+class Supervisor:
+    def __init__(self, workers, state_db: str, host: str, port: int):
+        self.workers = workers
+        self.state = SQLiteBackend(state_db, worker_id="supervisor")
+        self.host = host
+        self.port = port
+        self._stopping = False
+        self._runner = None
+
+    async def run(self):
+        await self.state.start()
+        if self.port: await self._start_status_server()
+        try: await asyncio.gather(*(self._keep_alive(worker) for worker in self.workers))
+        finally:
+            await self.stop_workers()
+            if self._runner is not None: await self._runner.cleanup()
+            await self.state.close()
+
+    def request_stop(self):
+        if self._stopping: return
+        logging.info("Arrêt demandé, fermeture des processus...")
+        self._stopping = True
+        for worker in self.workers:
+            if worker.process is not None and worker.process.returncode is None: worker.process.terminate()
+
+    async def stop_workers(self, timeout: float = 20):
+        self.request_stop()
+        for worker in self.workers:
+            if worker.process is None or worker.process.returncode is not None: continue
+            try: await asyncio.wait_for(worker.process.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f"Processus {worker.worker_id} ne répond pas, arrêt forcé."); worker.process.kill()
+
+    async def _keep_alive(self, worker: Worker):
+        delay = 1.0
+        while not self._stopping:
+            await worker.start()
+            code = await worker.process.wait()
+            if self._stopping: return
+            if time.monotonic() - worker.started_at >= STABLE_RUN_SECONDS: delay = 1.0
+            logging.error(f"Processus {worker.worker_id} arrêté (code {code}), relance dans {delay:.0f}s.")
+            worker.restarts += 1
+            await asyncio.sleep(delay)
+            delay = min(RESTART_MAX_DELAY_SECONDS, delay * 2)
+
+    async def status(self) -> dict:
+        aggregated = aggregate_status(await self.state.statuses())
+        aggregated["processes"] = {str(worker.worker_id): worker.info() for worker in self.workers}
+        return aggregated
+
+    async def _start_status_server(self):
+        app = web.Application()
+        app.router.add_get("/status", self._status)
+        app.router.add_get("/healthz", self._healthz)
+        app.router.add_get("/readyz", self._readyz)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info(f"Statut agrégé sur http://{self.host}:{self.port}/status")
+
+    async def _status(self, request):
+        return web.json_response(await self.status())
+
+    async def _healthz(self, request):
+        alive = sum(1 for worker in self.workers if worker.info()["running"])
+        return web.json_response({"status": "ok", "processes_running": alive})
+
+    async def _readyz(self, request):
+        status = await self.status()
+        ready = status["workers_ready"] == len(self.workers) and status["shards_ready"] == status["shard_count"] > 0
+        return web.json_response({"ready": ready, "workers_ready": status["workers_ready"], "workers": len(self.workers),
+                                  "shards_ready": status["shards_ready"], "shard_count": status["shard_count"]},
+                                 status=200 if ready else 503)
+
+
+async def main(args):
+    load_dotenv()
+    token = os.getenv("DISCORD_TOKEN")
+    if not token: logging.critical("ERREUR CRITIQUE: DISCORD_TOKEN absent du .env"); return 1
+    if os.getenv("STATE_BACKEND", "sqlite") != "sqlite":
+        logging.critical("Le mode multi-processus demande STATE_BACKEND=sqlite (état partagé entre processus)."); return 1
+    shard_count = args.shards or int(os.getenv("SHARD_COUNT") or "0")
+    if not shard_count:
+        try: shard_count = await recommended_shard_count(token)
+        except (aiohttp.ClientError, KeyError, ValueError) as e:
+            logging.critical(f"Nombre de shards recommandé indisponible ({e}), préciser --shards."); return 1
+    base_port = int(os.getenv("METRICS_PORT") or "9108")
+    workers = [Worker(index, shard_ids, shard_count, base_port + 1 + index if base_port else 0)
+               for index, shard_ids in enumerate(shard_groups(shard_count, args.workers))]
+    logging.info(f"{shard_count} shard(s) répartis sur {len(workers)} processus.")
+
+    supervisor = Supervisor(workers, os.getenv("CONVERSATIONS_DB", "conversations.db"),
+                            os.getenv("METRICS_HOST", "127.0.0.1"), base_port)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try: loop.add_signal_handler(sig, supervisor.request_stop)
+        except NotImplementedError: pass  # Windows : Ctrl+C lève KeyboardInterrupt
+    await supervisor.run()
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lance Fent-Droid en plusieurs processus (groupes de shards).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="nombre de processus (défaut: nombre de coeurs)")
+    parser.add_argument("--shards", type=int, default=0, help="nombre total de shards (défaut: SHARD_COUNT ou recommandation Discord)")
+    try: sys.exit(asyncio.run(main(parser.parse_args())))
+    except KeyboardInterrupt: pass
@@ -0,0 +1,56 @@
+import asyncio
+
+from coalescer import BurstCoalescer
+
+
+def run_coalescer(scenario, **options):
+    async def main():
+        batches = []
+
+        async def handler(key, items): batches.append((key, items))
+        coalescer = BurstCoalescer(handler, **options)
+        await scenario(coalescer)
+        return batches, coalescer
+    return asyncio.run(main())
+
+
+def test_burst_is_sent_as_one_batch_after_the_window():
+    async def scenario(coalescer):
+        for item in ("a", "b", "c"): coalescer.submit("salon", item)
+        assert coalescer.pending == 3
+        await asyncio.sleep(0.1)
+
+    batches, coalescer = run_coalescer(scenario, min_window=0.02, max_window=0.5)
+    assert batches == [("salon", ["a", "b", "c"])]
+    assert coalescer.pending == 0 and coalescer.batches == 1 and coalescer.messages == 3
+
+
+def test_max_batch_flushes_immediately_and_keys_are_independent():
+    async def scenario(coalescer):
+        for item in range(5): coalescer.submit("salon", item)
+        coalescer.submit("autre", "x")
+        await asyncio.sleep(0)
+        assert coalescer.pending == 2  # [4] et ["x"]
+        await asyncio.sleep(0.1)
+
+    batches, _ = run_coalescer(scenario, min_window=0.02, max_window=0.5, max_batch=2)
+    assert ("salon", [0, 1]) in batches and ("salon", [2, 3]) in batches
+    assert ("salon", [4]) in batches and ("autre", ["x"]) in batches
+
+
+def test_window_grows_only_while_messages_arrive_close_together():
+    async def scenario(coalescer):
+        assert coalescer.window_for("salon") == 0.05
+        coalescer.submit("salon", 1); await asyncio.sleep(0.3)
+        coalescer.submit("salon", 2)
+        assert coalescer.window_for("salon") == 0.05  # message isolé : fenêtre minimale
+        await asyncio.sleep(0.03)
+        coalescer.submit("salon", 3)
+        assert 0.05 < coalescer.window_for("salon") <= 0.2
+        await asyncio.sleep(0.4)
+        coalescer.submit("salon", 4)
+        assert coalescer.window_for("salon") == 0.05
+        await asyncio.sleep(0.1)
+
+    batches, _ = run_coalescer(scenario, min_window=0.05, max_window=0.2, gap_factor=4)
+    assert [items for _, items in batches] == [[1], [2, 3], [4]]
@@ -0,0 +1,54 @@
+"""Chaîne ModelPool -> ThreadedModel -> GeminiClient contre un faux serveur Gemini (API REST, comme GEMINI_API_ENDPOINT)."""
+import asyncio
+import json
+
+import google.generativeai as genai
+from aiohttp import web
+
+from gemini_client import GeminiClient, ThreadedModel
+from model_pool import ModelPool
+
+
+def candidate(text):
+    return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}]}
+
+
+async def with_fake_server(scenario):
+    requests = []
+
+    async def fake_gemini(request):
+        model_and_method = request.match_info["tail"]
+        requests.append((model_and_method, await request.json()))
+        if model_and_method.endswith(":streamGenerateContent"):
+            return web.Response(text=json.dumps([candidate("bon"), candidate("jour")]), content_type="application/json")
+        return web.json_response(candidate("bonjour"))
+
+    app = web.Application()
+    app.router.add_post("/v1beta/models/{tail:.*}", fake_gemini)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        genai.configure(api_key="test", transport="rest", client_options={"api_endpoint": f"http://127.0.0.1:{port}"})
+        return await scenario(requests)
+    finally:
+        await runner.cleanup()
+
+
+def test_generate_and_stream_through_rest_endpoint():
+    async def scenario(requests):
+        pool = ModelPool("gemini-test", wrap_model=ThreadedModel)
+        client = GeminiClient(["gemini-test"], max_attempts=1)
+        def get_model(name): return pool.get("default", "Tu es un robot.", name)
+
+        response = await client.generate(get_model, "salut")
+        chunks = [chunk.text async for chunk in client.stream(get_model, "salut")]
+        return response.text, chunks, requests
+
+    text, chunks, requests = asyncio.run(with_fake_server(scenario))
+    assert text == "bonjour"
+    assert chunks == ["bon", "jour"]
+    assert [path for path, _ in requests] == ["gemini-test:generateContent", "gemini-test:streamGenerateContent"]
+    assert requests[0][1]["systemInstruction"]["parts"][0]["text"] == "Tu es un robot."
@@ -0,0 +1,131 @@
+import asyncio
+import contextlib
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from gemini_client import CircuitBreaker, GeminiClient, GeminiUnavailable
+
+
+class FakeModel:
+    """Modèle Gemini factice : chaque appel consomme la prochaine action de `script`."""
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.calls = 0
+
+    async def generate_content_async(self, contents, stream=False):
+        self.calls += 1
+        action = self.script.pop(0) if self.script else "ok"
+        if isinstance(action, BaseException): raise action
+        if stream: return self._chunks(action)
+        return action
+
+    async def _chunks(self, action):
+        for chunk in (action if isinstance(action, list) else [action]): yield chunk
+
+
+def open_client(models, **options):
+    """Client dont tous les circuits sont ouverts depuis assez longtemps pour être semi-ouverts."""
+    client = GeminiClient(list(models), max_attempts=1, base_delay=0, failure_threshold=1, reset_timeout=0, **options)
+    for breaker in client.breakers.values(): breaker.record_failure()
+    return client
+
+
+def test_breaker_opens_after_threshold_and_probes_once():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_breaker_stays_open_before_reset_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+@pytest.mark.parametrize("error", [google_exceptions.InvalidArgument("requête invalide"), TypeError("bug"),
+                                   asyncio.CancelledError()])
+def test_generate_probe_released_on_unexpected_error(error):
+    model = FakeModel([error, "ok"])
+    client = open_client(["a"])
+    with pytest.raises(type(error)):
+        asyncio.run(client.generate(lambda name: model, "x"))
+    assert asyncio.run(client.generate(lambda name: model, "x")) == "ok"
+    assert client.breakers["a"].state == "closed"
+
+
+def test_stream_probe_released_when_consumer_stops():
+    model = FakeModel([["a", "b", "c"], ["d"]])
+    client = open_client(["a"])
+
+    async def first_chunk():
+        chunks = client.stream(lambda name: model, "x")
+        async for chunk in chunks:
+            await chunks.aclose()
+            return chunk
+
+    assert asyncio.run(first_chunk()) == "a"
+    assert client.breakers["a"].allow()
+
+
+def test_stream_probe_released_on_unexpected_error_before_first_chunk():
+    model = FakeModel([google_exceptions.PermissionDenied("clé refusée"), ["ok"]])
+    client = open_client(["a"])
+
+    async def collect():
+        return [chunk async for chunk in client.stream(lambda name: model, "x")]
+
+    with pytest.raises(google_exceptions.PermissionDenied): asyncio.run(collect())
+    assert asyncio.run(collect()) == ["ok"]
+
+
+def test_retryable_error_falls_back_to_next_model():
+    models = {"a": FakeModel([google_exceptions.ServiceUnavailable("surcharge")] * 5), "b": FakeModel([])}
+    client = GeminiClient(["a", "b"], max_attempts=3, base_delay=0, failure_threshold=1, reset_timeout=60)
+    assert asyncio.run(client.generate(models.get, "x")) == "ok"
+    assert models["a"].calls == 1 and models["b"].calls == 1
+    assert client.breakers["a"].state == "open"
+
+
+def test_all_circuits_open_raises_unavailable():
+    client = GeminiClient(["a"], max_attempts=1, failure_threshold=1, reset_timeout=60)
+    client.breakers["a"].record_failure()
+    with pytest.raises(GeminiUnavailable):
+        asyncio.run(client.generate(lambda name: FakeModel([]), "x"))
+
+
+
+def test_llm_slot_is_released_during_backoff():
+    held = []
+
+    @contextlib.asynccontextmanager
+    async def slot():
+        held.append("slot")
+        try: yield
+        finally: held.remove("slot")
+
+    class RecordingClient(GeminiClient):
+        async def _backoff(self, attempt, error, model_name):
+            backoff_slots.append(list(held))
+            await super()._backoff(attempt, error, model_name)
+
+    backoff_slots = []
+    model = FakeModel([google_exceptions.ServiceUnavailable("surcharge"), "ok",
+                       google_exceptions.ServiceUnavailable("surcharge"), ["a"]])
+    client = RecordingClient(["a"], max_attempts=2, base_delay=0, failure_threshold=5, slot=slot)
+
+    async def scenario():
+        response = await client.generate(lambda name: model, "x")
+        chunks = [chunk async for chunk in client.stream(lambda name: model, "x")]
+        return response, chunks
+
+    assert asyncio.run(scenario()) == ("ok", ["a"])
+    assert backoff_slots == [[], []] and held == []
@@ -0,0 +1,71 @@
+import asyncio
+import json
+
+from attachments import AttachmentStore, marker_for
+from conversation_store import ConversationStore
+from history_window import HistoryWindow, TokenEstimator
+
+KEY = "0123456789abcdef0123456789abcdef"
+
+
+def attachment_store(tmp_path, text_chars: int) -> AttachmentStore:
+    (tmp_path / KEY).write_text("x" * text_chars, encoding="utf-8")
+    (tmp_path / "index.json").write_text(json.dumps(
+        {KEY: {"mime": "text/plain", "name": "log.txt", "mode": "text", "size": text_chars, "last_used": 0}}))
+    store = AttachmentStore(str(tmp_path))
+    store.load()
+    return store
+
+
+def test_expanded_attachments_count_against_the_budget(tmp_path):
+    attachments = attachment_store(tmp_path, 20000)
+    window = HistoryWindow(None, token_budget=3000, estimator=TokenEstimator(extra_tokens=attachments.estimate_tokens))
+    conversation = ConversationStore().get((1, 2, None))
+    conversation.append_turn(f"regarde {marker_for(KEY, 'text/plain', 'log.txt')}", "vu")
+    conversation.append_turn("et maintenant ?", "rien")
+
+    assert attachments.estimate_tokens(conversation.history[0]["parts"][0]) > 5000
+    window.fit(conversation)
+    assert [turn["parts"][0] for turn in conversation.history] == ["et maintenant ?", "rien"]
+    assert len(conversation.evicted) == 2
+
+
+def test_unknown_marker_costs_nothing_extra(tmp_path):
+    attachments = attachment_store(tmp_path, 100)
+    assert attachments.estimate_tokens("pas de pièce jointe") == 0
+    assert attachments.estimate_tokens(marker_for("f" * 32, "image/png", "x.png")) == 0
+
+
+class RecordingSummaryModel:
+    """Modèle de résumé factice : enregistre les prompts, échoue tant que `failing`."""
+
+    def __init__(self):
+        self.prompts = []
+        self.failing = True
+
+    async def generate_content_async(self, prompt):
+        self.prompts.append(prompt)
+        if self.failing: raise ConnectionError("Gemini indisponible")
+        return type("Response", (), {"parts": ["ok"], "text": "résumé"})()
+
+
+def test_summary_backlog_and_prompt_stay_bounded():
+    model = RecordingSummaryModel()
+    window = HistoryWindow(model, token_budget=100, summary_batch_tokens=200, max_evicted_tokens=600)
+    conversation = ConversationStore(max_items=1000).get((1, 2, None))
+
+    async def scenario():
+        for i in range(40):
+            conversation.append_turn(f"question {i} " + "x" * 200, "réponse " + "y" * 200)
+            window.fit(conversation)
+            window.schedule_summary(conversation)
+            await asyncio.sleep(0)
+        model.failing = False
+        window.schedule_summary(conversation)
+        await asyncio.sleep(0.01)
+
+    asyncio.run(scenario())
+    assert sum(window._summary_tokens(turn) for turn in conversation.evicted) <= 600
+    assert max(len(prompt) for prompt in model.prompts) < len(HistoryWindow.SUMMARY_PROMPT) + 200 * 4 + 100
+    assert conversation.summary == "résumé"
+    assert conversation.folded > 70  # tours abandonnés et résumés, non rechargés par le journal
@@ -0,0 +1,34 @@
+import asyncio
+import datetime
+
+import google.generativeai as genai
+from google.generativeai import caching
+
+from model_pool import ModelPool
+
+
+class FakeCachedContent:
+    name = "cachedContents/test"
+
+    def delete(self): pass
+
+
+def test_expired_server_cache_falls_back_to_system_instruction_model(monkeypatch):
+    cached_model = object()
+    monkeypatch.setattr(caching.CachedContent, "create", classmethod(lambda cls, **kwargs: FakeCachedContent()))
+    monkeypatch.setattr(genai.GenerativeModel, "from_cached_content", classmethod(lambda cls, cached: cached_model))
+
+    async def scenario():
+        pool = ModelPool("gemini-test", cache_min_chars=10)
+        base_model = pool.get("default", "un long prompt de persona")
+        await asyncio.sleep(0.05)  # création du cache en arrière-plan
+        with_cache = pool.get("default", "un long prompt de persona")
+        entry = pool._entries[("default", "gemini-test")]
+        entry.cache_expires_at = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=1)
+        entry.cache_task = asyncio.get_running_loop().create_future()  # recréation en cours
+        return base_model, with_cache, pool.get("default", "un long prompt de persona")
+
+    base_model, with_cache, after_expiry = asyncio.run(scenario())
+    assert isinstance(base_model, genai.GenerativeModel)
+    assert with_cache is cached_model
+    assert after_expiry is base_model
@@ -0,0 +1,107 @@
+import asyncio
+
+from conversation_store import ConversationStore
+from persistence import ConversationLog
+
+KEY = (1, 2, None)
+
+
+def run_with_log(tmp_path, scenario, **options):
+    async def main():
+        log = ConversationLog(str(tmp_path / "conversations.db"), flush_interval=3600, **options)
+        await log.start()
+        try: return await scenario(log)
+        finally: await log.close()
+    return asyncio.run(main())
+
+
+def store_for(log, **options):
+    store = ConversationStore(**options)
+    store.log = log
+    return store
+
+
+def test_evicted_conversation_reloads_unflushed_turns(tmp_path):
+    async def scenario(log):
+        store = store_for(log, max_conversations=1)
+        conv = await store.load(KEY)
+        conv.append_turn("bonjour", "salut")
+        await store.load((1, 3, None))  # évince KEY avant l'écriture du lot
+        assert KEY not in store and log._pending
+        return await store.load(KEY)
+
+    conv = run_with_log(tmp_path, scenario)
+    assert [turn["parts"][0] for turn in conv.history] == ["bonjour", "salut"]
+
+
+def test_folded_turns_are_not_reloaded(tmp_path):
+    async def scenario(log):
+        conv = await store_for(log).load(KEY)
+        for i in range(3): conv.append_turn(f"q{i}", f"r{i}")
+        conv.evict_oldest(); conv.evict_oldest()
+        conv.update_summary("q0/r0 résumés", 2)
+        await log.flush()
+        reloaded = await store_for(log).load(KEY)
+        reloaded.evict_oldest(); reloaded.evict_oldest()
+        reloaded.update_summary("q0 à r1 résumés", 2)
+        reloaded.append_turn("q3", "r3")
+        await log.flush()
+        return reloaded, await store_for(log).load(KEY)
+
+    first, second = run_with_log(tmp_path, scenario)
+    assert first.folded == second.folded == 4
+    assert second.summary == "q0 à r1 résumés"
+    assert [turn["parts"][0] for turn in second.history] == ["q2", "r2", "q3", "r3"]
+
+
+def test_load_returns_latest_turns_of_current_epoch(tmp_path):
+    async def scenario(log):
+        assert await log.load(KEY) is None
+        conv = await store_for(log).load(KEY)
+        conv.append_turn("ancien", "oublié")
+        conv.reset("pirate", touch=True)
+        for i in range(3): conv.append_turn(f"q{i}", f"r{i}")
+        await log.flush()
+        return await log.load(KEY)
+
+    state = run_with_log(tmp_path, scenario, max_load_items=3)
+    assert state["persona_id"] == "pirate" and state["epoch"] == 1
+    assert [turn["parts"][0] for turn in state["turns"]] == ["q2", "r2"]  # le tour modèle orphelin est écarté
+    assert state["folded"] == 4
+
+
+def test_compact_removes_old_epochs_and_expired_conversations(tmp_path):
+    async def scenario(log):
+        store = store_for(log)
+        active = await store.load(KEY)
+        active.append_turn("ancien", "oublié"); active.reset(touch=True); active.append_turn("q", "r")
+        idle = await store.load((1, 3, None))
+        idle.append_turn("q", "r")
+        await log.flush()
+        log.retention = 0.2
+        await asyncio.sleep(0.3)
+        active.append_turn("q2", "r2"); await log.flush()
+        removed = await log.compact()
+        return removed, await log.load(KEY), await log.load((1, 3, None))
+
+    removed, active, idle = run_with_log(tmp_path, scenario)
+    assert removed == 5  # 2 tours de l'ancienne epoch, 2 tours et l'état de la conversation inactive
+    assert [turn["parts"][0] for turn in active["turns"]] == ["q", "r", "q2", "r2"]
+    assert idle is None
+
+
+def test_expired_conversation_does_not_come_back(tmp_path):
+    async def scenario(log):
+        conv = await store_for(log).load(KEY)
+        conv.append_turn("vieux secret", "ok")
+        await log.flush()
+        log.retention = 0.2
+        await asyncio.sleep(0.3)
+        fresh = await store_for(log).load(KEY)
+        fresh.append_turn("nouveau", "réponse")
+        await log.flush()
+        return fresh, await store_for(log).load(KEY)
+
+    fresh, reloaded = run_with_log(tmp_path, scenario)
+    assert fresh.epoch == 1
+    assert [turn["parts"][0] for turn in reloaded.history] == ["nouveau", "réponse"]
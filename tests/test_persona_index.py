@@ -0,0 +1,34 @@
+from persona_registry import PersonaIndex, normalize
+
+PERSONAS = {
+    "default": {"name": "Fent-Droid"},
+    "eric": {"name": "Éric le Pirate"},
+    "pirate_cap": {"name": "Capitaine Crochet"},
+    "robot": {"name": "Robot Poli"},
+}
+
+
+def test_normalize_removes_accents_and_case():
+    assert normalize("  Éric ") == "eric"
+
+
+def test_prefix_search_matches_ids_names_and_words():
+    index = PersonaIndex(PERSONAS)
+    assert index.search("er") == ["eric"]
+    assert index.search("pira")[:2] == ["eric", "pirate_cap"]
+    assert index.search("capi") == ["pirate_cap"]
+    assert index.search("") == sorted(PERSONAS)
+
+
+def test_fuzzy_search_tolerates_typos():
+    assert "robot" in PersonaIndex(PERSONAS).search("robto")
+
+
+def test_incremental_update_and_remove():
+    index = PersonaIndex(PERSONAS)
+    index.update("robot", {"name": "Androïde"})
+    assert index.search("andro") == ["robot"]
+    assert "robot" not in index.search("poli")
+    index.remove("eric")
+    assert "eric" not in index.search("pira")
+    assert index.ids() == ["default", "pirate_cap", "robot"] and len(index) == 3
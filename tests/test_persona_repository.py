@@ -0,0 +1,84 @@
+import asyncio
+import json
+import time
+
+import persona_repository
+from persona_repository import PersonaRepository
+
+
+def test_edit_during_write_is_saved_and_announced(tmp_path, monkeypatch):
+    saved = []
+    repo = PersonaRepository(str(tmp_path / "personas.json"), str(tmp_path / "prompt.txt"), save_delay=0.01,
+                             on_saved=lambda changed, removed: saved.append(changed))
+    repo.load()
+    real_write_atomic = persona_repository.write_atomic
+
+    def slow_write_atomic(path, data):
+        time.sleep(0.1); return real_write_atomic(path, data)
+    monkeypatch.setattr(persona_repository, "write_atomic", slow_write_atomic)
+
+    async def scenario():
+        repo.personas["a"] = {"name": "A", "prompt": "a"}; repo.save()
+        await asyncio.sleep(0.05)  # première écriture en cours
+        repo.personas["b"] = {"name": "B", "prompt": "b"}; repo.save()
+        await repo._save_task
+
+    asyncio.run(scenario())
+    assert saved == [{"a"}, {"b"}]
+    assert set(json.loads((tmp_path / "personas.json").read_text(encoding="utf-8"))) == {"default", "a", "b"}
+
+
+def test_save_keeps_personas_written_by_another_process(tmp_path):
+    path = tmp_path / "personas.json"
+    repo = PersonaRepository(str(path), str(tmp_path / "prompt.txt"), save_delay=0)
+    repo.load()
+    other = json.loads(path.read_text(encoding="utf-8"))
+    other["external"] = {"name": "E", "prompt": "e"}
+    path.write_text(json.dumps(other), encoding="utf-8")
+
+    async def scenario():
+        repo.personas["local"] = {"name": "L", "prompt": "l"}; repo.save()
+        await repo._save_task
+
+    asyncio.run(scenario())
+    assert set(json.loads(path.read_text(encoding="utf-8"))) == {"default", "local", "external"}
+    assert "external" in repo.personas
+
+
+def test_prompt_txt_hot_reload_changes_default(tmp_path):
+    prompt = tmp_path / "prompt.txt"
+    prompt.write_text("Premier prompt.", encoding="utf-8")
+    changes = []
+    repo = PersonaRepository(str(tmp_path / "personas.json"), str(prompt), save_delay=0,
+                             on_change=lambda changed, removed: changes.append(changed))
+    repo.load()
+
+    async def scenario():
+        repo.personas["a"] = {"name": "A", "prompt": "a"}; repo.save()
+        await repo._save_task
+        prompt.write_text("Second prompt, plus long.", encoding="utf-8")
+        return await repo.reload_if_changed()
+
+    assert asyncio.run(scenario())
+    assert changes == [{"default"}]
+    assert repo.personas["default"]["prompt"] == "Second prompt, plus long."
+    assert "prompt" not in json.loads((tmp_path / "personas.json").read_text(encoding="utf-8"))["default"]
+
+
+def test_flush_writes_edits_of_a_cancelled_save(tmp_path):
+    path = tmp_path / "personas.json"
+    lock = tmp_path / "personas.json.lock"
+    repo = PersonaRepository(str(path), str(tmp_path / "prompt.txt"), save_delay=0)
+    repo.load()
+
+    async def scenario():
+        lock.write_text("")  # un autre processus écrit : la sauvegarde attend le verrou
+        repo.personas["a"] = {"name": "A", "prompt": "a"}; repo.save()
+        await asyncio.sleep(0.05)
+        flushing = asyncio.create_task(repo.flush())
+        await asyncio.sleep(0.05)
+        lock.unlink()
+        await flushing
+
+    asyncio.run(scenario())
+    assert "a" in json.loads(path.read_text(encoding="utf-8"))
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from scheduler import Scheduler, SchedulerBusy
+
+
+def test_turns_of_a_conversation_run_in_arrival_order():
+    async def scenario():
+        scheduler = Scheduler(max_concurrent=4)
+        order = []
+
+        async def turn(key, name, delay):
+            async with scheduler.slot(key):
+                await asyncio.sleep(delay); order.append(name)
+
+        await asyncio.gather(turn("a", "a1", 0.03), turn("a", "a2", 0), turn("b", "b1", 0))
+        return order, scheduler
+
+    order, scheduler = asyncio.run(scenario())
+    assert order.index("a1") < order.index("a2")
+    assert order[0] == "b1"
+    assert not scheduler._locks
+
+
+def test_llm_calls_are_capped():
+    async def scenario():
+        scheduler = Scheduler(max_concurrent=2)
+        peak = 0
+
+        async def call():
+            nonlocal peak
+            async with scheduler.llm():
+                peak = max(peak, scheduler.in_flight); await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(call() for _ in range(6)))
+        return peak, scheduler.stats()
+
+    peak, stats = asyncio.run(scenario())
+    assert peak == 2
+    assert stats["completed"] == 6 and stats["in_flight"] == 0 and stats["waiting"] == 0
+
+
+def test_requests_beyond_max_waiting_are_shed():
+    async def scenario():
+        scheduler = Scheduler(max_concurrent=1, max_waiting=1)
+        release = asyncio.Event()
+
+        async def hold():
+            async with scheduler.llm(): await release.wait()
+
+        async def wait_turn():
+            async with scheduler.slot("a"):
+                async with scheduler.llm(): pass
+
+        holder = asyncio.create_task(hold()); await asyncio.sleep(0)
+        waiter = asyncio.create_task(wait_turn()); await asyncio.sleep(0)
+        with pytest.raises(SchedulerBusy):
+            async with scheduler.slot("b"): pass
+        release.set(); await asyncio.gather(holder, waiter)
+        return scheduler.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["shed"] == 1 and stats["completed"] == 2